@@ -0,0 +1,165 @@
+"""
+On disk cache of the annotations index, so that repeated runs skip the parsing of the coco json or open images csv.
+The index is stored as packed numpy arrays sorted by filename, memory-mapped at load time:
+pages are read only for the images looked up and shared between concurrent processes.
+Smaller results such as directory listings are cached as json, valid while the stamp of their sources is unchanged
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+_ARRAYS = ['names', 'offsets', 'boxes', 'labels']
+
+
+class PackedIndex(Mapping):
+    """
+    Read only mapping filename -> (boxes array, labels array) over the arrays of a cache directory
+    names are sorted so a lookup is a binary search on the memory-mapped names array
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in _ARRAYS}
+        vocab_path = os.path.join(path, 'label_vocab.npy')
+        self.label_vocab = np.load(vocab_path) if os.path.isfile(vocab_path) else None
+
+    def _position(self, key):
+        names = self.arrays['names']
+        position = int(np.searchsorted(names, key))
+        if position < len(names) and names[position] == key:
+            return position
+        return None
+
+    def __getitem__(self, key):
+        position = self._position(key) if isinstance(key, str) else None
+        if position is None:
+            raise KeyError(key)
+        start, end = self.arrays['offsets'][position:position + 2]
+        boxes = np.asarray(self.arrays['boxes'][start:end])
+        labels = np.asarray(self.arrays['labels'][start:end])
+        if self.label_vocab is not None:
+            labels = self.label_vocab[labels]
+        return boxes, labels
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self._position(key) is not None
+
+    def __iter__(self):
+        return (str(name) for name in self.arrays['names'])
+
+    def __len__(self):
+        return len(self.arrays['names'])
+
+    def __reduce__(self):
+        # workers reopen the memory-mapped files instead of receiving a copy of the arrays
+        return PackedIndex, (self.path,)
+
+
+def cache_key(source_path, kind):
+    # key of the cache from the path, size and modification time of the annotations file
+    stat = os.stat(source_path)
+    key = f"{kind}|{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return kind + '_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def save_index(index, path, meta=None):
+    """
+    Write the index filename -> (boxes, labels) as packed arrays into the directory path
+    Args:
+        index: dict mapping filename to a tuple (boxes array (N, 4), labels array (N,))
+        path: directory to create
+        meta: json serializable data stored with the index (coco categories ...)
+    """
+    os.makedirs(path)
+    names = sorted(index)
+    counts = [len(index[name][0]) for name in names]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if len(names) > 0:
+        boxes = np.concatenate([np.asarray(index[name][0]).reshape(-1, 4) for name in names])
+        labels = np.concatenate([np.asarray(index[name][1]) for name in names])
+    else:
+        boxes, labels = np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int32)
+    if labels.dtype.kind in 'OUS':
+        # string labels (open images LabelName) are stored as int32 codes into a vocabulary
+        vocab, codes = np.unique(labels.astype(str), return_inverse=True)
+        np.save(os.path.join(path, 'label_vocab.npy'), vocab)
+        labels = codes.astype(np.int32)
+    arrays = {'names': np.array(names, dtype=str), 'offsets': offsets, 'boxes': boxes, 'labels': labels}
+    for name in _ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_index(path):
+    # open the cached index of the directory path, return the index and the meta data
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    return PackedIndex(path), meta
+
+
+def cached_index(cache_dir, source_path, kind, build):
+    """
+    Load the index of source_path from the cache, build and store it if it is not in the cache
+    Args:
+        cache_dir: directory of the cache
+        source_path: path to the annotations file, the cache is invalidated when its size or mtime change
+        kind: format of the annotations file (coco, open_images)
+        build: function without argument returning (index, meta) from the annotations file
+
+    Returns:
+        the index (PackedIndex) and meta data
+    """
+    path = os.path.join(cache_dir, cache_key(source_path, kind))
+    if not os.path.isdir(path):
+        index, meta = build()
+        os.makedirs(cache_dir, exist_ok=True)
+        # write into a temporary directory then rename, concurrent runs never read a partial cache
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp_')
+        save_index(index, os.path.join(tmp_dir, 'index'), meta)
+        try:
+            os.rename(os.path.join(tmp_dir, 'index'), path)
+        except OSError:
+            # another process stored the same index first
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return load_index(path)
+
+
+def cached_json(cache_dir, name, stamp, build):
+    """
+    Load a json serializable result from the cache, build and store it when the stamp changed
+    Args:
+        cache_dir: directory of the cache
+        name: name of the cache file
+        stamp: json serializable state of the sources (directories mtime ...), the cache is valid while it is equal,
+            or a function computing it from the stamp stored (None if there is none) so only its sources are checked
+        build: function without argument returning the result
+
+    Returns:
+        the cached or built result
+    """
+    path = os.path.join(cache_dir, name + '.json')
+    cached = None
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            cached = json.load(f)
+    if callable(stamp):
+        stamp = stamp(cached['stamp'] if cached else None)
+    if cached and cached['stamp'] == stamp:
+        return cached['result']
+    result = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp_')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'stamp': stamp, 'result': result}, f)
+    os.replace(tmp_path, path)
+    return result
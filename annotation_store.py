@@ -0,0 +1,292 @@
+"""
+Columnar annotation store shared by the draw and duplicate tools: the coco json, the open images csv and the yolo
+labels of the open images datasets are converted once into one parquet file with a row per box
+(image_id, file_name, dataset, split, category, x1, y1, x2, y2, w, h and normalized). The coordinates are float64
+as parsed from the sources, the width w and height h of the coco boxes are kept as given so that the boxes read
+from the store are the coco (x, y, w, h) boxes bit for bit.
+An image without box has one row with NaN coordinates, so the store also lists the images of every dataset.
+The rows are sorted by file_name, so the min/max statistics of every row group give the range of its filenames and
+only the row groups holding the filenames requested are read.
+pyarrow is needed only to convert or read a store
+"""
+import json
+import logging
+import os
+from argparse import ArgumentParser
+from bisect import bisect_left
+
+import numpy as np
+
+from logging_setup import setup_logging
+
+STORE_COLUMNS = ['image_id', 'file_name', 'dataset', 'split', 'category', 'x1', 'y1', 'x2', 'y2', 'w', 'h',
+                 'normalized']
+BOX_COLUMNS = ['x1', 'y1', 'x2', 'y2']
+SIZE_COLUMNS = ['w', 'h']
+ROW_GROUP_SIZE = 65536
+SPLITS = ['train', 'test', 'validation']
+
+
+def store_args():
+    parser = ArgumentParser()
+    parser.add_argument('store', help='path of the parquet annotation store written', type=str)
+    parser.add_argument('--coco', help='coco annotation files to convert', nargs='+', default=[])
+    parser.add_argument('--open_images', help='open images annotation csv files to convert, the split is read from '
+                                              'the file name (train, test, validation)', nargs='+', default=[])
+    parser.add_argument('--open_images_path', help='path where all open images path are, their yolo labels are '
+                                                   'converted', type=str)
+    parser.add_argument('--open_images_prefixe', help='prefixe of open_images dataset', type=str)
+    parser.add_argument('--categories', help='categories of the open images datasets', nargs='+',
+                        default=['cat', 'dog', 'person'])
+    parser.add_argument('--row_group_size', help='number of rows of every row group', type=int,
+                        default=ROW_GROUP_SIZE)
+    args = parser.parse_args()
+    return args
+
+
+def import_pyarrow():
+    # pyarrow is an optional dependency, only the annotation store needs it
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('the annotation store needs pyarrow, install it with pip install pyarrow') from None
+    return pyarrow, pyarrow.compute, pyarrow.parquet
+
+
+def is_store(path):
+    return bool(path) and path.lower().endswith('.parquet')
+
+
+def infer_split(path):
+    # split of an annotations file from its name (train-annotations-bbox.csv ...), '' if none
+    name = os.path.basename(path).lower()
+    for split in SPLITS:
+        if name.startswith(split):
+            return split
+    return ''
+
+
+def store_frame(image_id, file_name, dataset, split, category, boxes, normalized, sizes=None):
+    # dataframe of rows in the store layout, the scalar columns are broadcast, the sizes of the boxes are
+    # computed from their corners if not given
+    import pandas as pd
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    sizes = boxes[:, 2:] - boxes[:, :2] if sizes is None else np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    frame = pd.DataFrame({'image_id': image_id, 'file_name': file_name, 'dataset': dataset, 'split': split,
+                          'category': category}, index=range(len(boxes)))
+    for position, column in enumerate(BOX_COLUMNS):
+        frame[column] = boxes[:, position]
+    for position, column in enumerate(SIZE_COLUMNS):
+        frame[column] = sizes[:, position]
+    frame['normalized'] = normalized
+    return frame[STORE_COLUMNS]
+
+
+def coco_frame(annot_path):
+    """ rows of a coco annotation file (dataset coco), boxes (x, y, w, h) as pixel corners with their w and h as given
+    and category ids as their name """
+    import pandas as pd
+
+    with open(annot_path, 'r') as f:
+        data = json.load(f)
+    names = {category['id']: category['name'] for category in data['categories']}
+    images = pd.DataFrame(data['images'], columns=['id', 'file_name'])
+    annotations = pd.DataFrame(data['annotations'], columns=['image_id', 'category_id', 'bbox'])
+    boxes = np.asarray(annotations['bbox'].tolist(), dtype=np.float64).reshape(-1, 4)
+    sizes = boxes[:, 2:].copy()
+    boxes[:, 2:] += boxes[:, :2]
+    file_names = annotations['image_id'].map(pd.Series(images['file_name'].values, index=images['id'].values))
+    categories = [str(names.get(category_id, category_id)) for category_id in annotations['category_id']]
+    frames = [store_frame(annotations['image_id'].astype(str).values, file_names.values, 'coco',
+                          infer_split(annot_path), categories, boxes, False, sizes)]
+    # images without annotations
+    empty = images[~images['id'].isin(annotations['image_id'])]
+    frames.append(store_frame(empty['id'].astype(str).values, empty['file_name'].values, 'coco',
+                              infer_split(annot_path), None, np.full((len(empty), 4), np.nan), False))
+    return pd.concat(frames, ignore_index=True)
+
+
+def open_images_frame(csv_path):
+    """ rows of an open images annotation csv, normalized boxes with their LabelName, the file name is ImageID.jpg """
+    import pandas as pd
+
+    annotations = pd.read_csv(csv_path, header=0, usecols=['ImageID', 'LabelName', 'XMin', 'XMax', 'YMin', 'YMax'])
+    image_ids = annotations['ImageID'].astype(str)
+    return store_frame(image_ids.values, (image_ids + '.jpg').values, 'open_images',
+                       infer_split(csv_path), annotations['LabelName'].values,
+                       annotations[['XMin', 'YMin', 'XMax', 'YMax']].to_numpy(dtype=np.float64), True)
+
+
+def yolo_frame(open_images_path, prefixe, categories, splits=SPLITS):
+    """ rows of the yolo labels of every open images dataset (<prefixe>_<category>, split), boxes in pixels with their
+    class index as category, the images of the tar/zip shards included """
+    from draw_openimages import construct_path
+    from shards import is_shard, shard_images
+    from yolo_labels import YoloLabels
+
+    yolo_labels = YoloLabels()
+    columns = {'image_id': [], 'file_name': [], 'dataset': [], 'split': [], 'category': []}
+    boxes = []
+    for category in categories:
+        for split in splits:
+            path = construct_path(open_images_path, prefixe, category, split)
+            if not os.path.isdir(path):
+                continue
+            images = {}
+            with os.scandir(path) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if not entry.is_file():
+                        continue
+                    if is_shard(entry.name):
+                        for name, member_path in shard_images(entry.path):
+                            images.setdefault(name, member_path)
+                    else:
+                        images[entry.name] = entry.path
+            for name, image_path in images.items():
+                annot = yolo_labels.get(image_path)
+                if annot is None or len(annot[1]) == 0:
+                    annot_boxes, classes = np.full((1, 4), np.nan), [None]
+                else:
+                    annot_boxes, classes = annot[0], [str(class_id) for class_id in annot[1].tolist()]
+                count = len(classes)
+                columns['image_id'] += [os.path.splitext(name)[0]] * count
+                columns['file_name'] += [name] * count
+                columns['dataset'] += [prefixe + '_' + category] * count
+                columns['split'] += [split] * count
+                columns['category'] += classes
+                boxes.append(annot_boxes)
+    return store_frame(columns['image_id'], columns['file_name'], columns['dataset'], columns['split'],
+                       columns['category'], np.concatenate(boxes) if len(boxes) > 0 else np.zeros((0, 4)), False)
+
+
+def write_store(frames, store, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the rows into the parquet store sorted by file_name, the order of the rows of a file_name is kept
+    Args:
+        frames: list of dataframes in the store layout
+        store: path of the parquet file
+        row_group_size: number of rows of every row group
+
+    Returns:
+        number of rows written
+    """
+    import pandas as pd
+
+    pa, _, pq = import_pyarrow()
+    rows = pd.concat(frames, ignore_index=True) if len(frames) > 0 else store_frame([], [], [], [], [], [], False)
+    rows = rows.sort_values('file_name', kind='stable', ignore_index=True)
+    schema = pa.schema([(column, pa.string()) for column in STORE_COLUMNS[:5]] +
+                       [(column, pa.float64()) for column in BOX_COLUMNS + SIZE_COLUMNS] + [('normalized', pa.bool_())])
+    table = pa.Table.from_pandas(rows, schema=schema, preserve_index=False)
+    directory = os.path.dirname(store)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    pq.write_table(table, store, row_group_size=row_group_size)
+    return table.num_rows
+
+
+def _row_groups(parquet_file, column, values):
+    # row groups whose min/max statistics of column can hold one of the sorted values
+    metadata = parquet_file.metadata
+    index = parquet_file.schema_arrow.get_field_index(column)
+    groups = []
+    for group in range(metadata.num_row_groups):
+        statistics = metadata.row_group(group).column(index).statistics
+        if statistics is None or not statistics.has_min_max:
+            groups.append(group)
+            continue
+        position = bisect_left(values, statistics.min)
+        if position < len(values) and values[position] <= statistics.max:
+            groups.append(group)
+    return groups
+
+
+def read_store(store, column=None, values=None, datasets=None, split=None, columns=None):
+    """
+    Read the rows of the store with predicate pushdown: only the row groups whose statistics can hold one
+    of values are read, then the rows are filtered
+    Args:
+        store: path of the parquet store
+        column: column of values (file_name or image_id), all the rows if None
+        values: iterable of the values of column to keep
+        datasets: keep only the rows of these datasets if given
+        split: keep only the rows of this split if given
+        columns: columns read, all if None
+
+    Returns:
+        dataframe of the rows, in the order of the store
+    """
+    pa, pc, pq = import_pyarrow()
+    parquet_file = pq.ParquetFile(store)
+    read_columns = None if columns is None else list(dict.fromkeys(
+        list(columns) + [name for name, used in [(column, values is not None), ('dataset', datasets is not None),
+                                                   ('split', split is not None)] if used]))
+    if values is not None:
+        values = sorted(set(values))
+        groups = _row_groups(parquet_file, column, values)
+        logging.info(f"store {store}: {len(groups)} of {parquet_file.metadata.num_row_groups} row groups read")
+        table = parquet_file.read_row_groups(groups, columns=read_columns)
+        table = table.filter(pc.is_in(table[column], value_set=pa.array(values, pa.string())))
+    else:
+        table = parquet_file.read(columns=read_columns)
+    if datasets is not None:
+        table = table.filter(pc.is_in(table['dataset'], value_set=pa.array(list(datasets), pa.string())))
+    if split is not None:
+        table = table.filter(pc.equal(table['split'], split))
+    rows = table.to_pandas()
+    return rows if columns is None else rows[list(columns)]
+
+
+def store_index(store, key='file_name', file_names=None, datasets=None, box_columns=BOX_COLUMNS):
+    """
+    Build the annotation index of the rows of the store for the given datasets
+    Args:
+        store: path of the parquet store
+        key: column of the index key, file_name or image_id
+        file_names: file names of the images to load, all the images of the datasets if None. The row groups are
+            pruned on file_name, the sort key of the store, whatever the key of the index
+        datasets: datasets of the rows (coco, open_images, <prefixe>_<category> ...)
+        box_columns: the 4 columns of the boxes, the corners or x1, y1, w, h for the coco (x, y, w, h) boxes
+
+    Returns:
+        dict mapping key to a tuple (boxes float64 array (N, 4), category array (N,)), the images without box
+        are left out, the boxes of the rows of several datasets are concatenated in the order of the store
+    """
+    rows = read_store(store, 'file_name', file_names, datasets, columns=[key, 'category'] + list(box_columns))
+    rows = rows[rows[box_columns[0]].notna()]
+    boxes = rows[list(box_columns)].to_numpy(dtype=np.float64)
+    categories = rows['category'].to_numpy()
+    groups = rows.groupby(key, sort=False).indices
+    return {name: (boxes[positions], categories[positions]) for name, positions in groups.items()}
+
+
+def main(store, coco=(), open_images=(), open_images_path=None, prefixe=None,
+         categories=('cat', 'dog', 'person'), row_group_size=ROW_GROUP_SIZE):
+    """
+    Convert the annotations of every source given into the annotation store
+    Args:
+        store: path of the parquet store written
+        coco: coco annotation files
+        open_images: open images annotation csv files
+        open_images_path: path where all open images path are, their yolo labels are converted if given
+        prefixe: prefixe of open_images dataset
+        categories: categories of the open images datasets
+        row_group_size: number of rows of every row group
+    """
+    import_pyarrow()
+    frames = [coco_frame(path) for path in coco]
+    frames += [open_images_frame(path) for path in open_images]
+    if open_images_path:
+        frames.append(yolo_frame(open_images_path, prefixe, categories))
+    rows = write_store(frames, store, row_group_size)
+    logging.info(f"{rows} rows written into {store}")
+
+
+if __name__ == '__main__':
+    setup_logging('logs/logs_store', 'log_store_')
+    args = store_args()
+    main(args.store, args.coco, args.open_images, args.open_images_path, args.open_images_prefixe,
+         args.categories, args.row_group_size)
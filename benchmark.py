@@ -0,0 +1,360 @@
+"""
+Benchmark of the draw and duplicate tools on synthetic datasets generated at several scales.
+The generated datasets follow the layout the tools expect: one coco json with its images directory, and the open
+images datasets <prefixe>_<category>/raw/1/<split>/<category> (construct_path, get_path) with their yolo labels,
+the open images annotations csv and the label descriptions, a part of the images being copied into several
+categories to be found as duplicates.
+Every stage (annotations loading, per image lookup, images location, drawing, duplicate scan) is timed and reported
+with its throughput and its peak of memory allocated, measured by tracemalloc on a separate run
+
+With --baseline, the times are compared to the results of a previous run and the stages slower by more than
+--tolerance are reported, the exit status is then 1 so a regression fails the check
+
+usage: python benchmark.py --sizes 1000 10000 --output benchmark.json
+       python benchmark.py --sizes 1000 10000 --baseline benchmark.json
+"""
+import csv
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+
+BENCH_CATEGORIES = ['cat', 'dog', 'person']
+LABEL_IDS = {'cat': '/m/01yrx', 'dog': '/m/0bt9lr', 'person': '/m/01g317'}
+PREFIXE = 'open-images-v6'
+SUFFIXE = 'raw/1'
+# differences of time below it are timer noise, never reported as a regression
+NOISE_SECONDS = 0.001
+
+
+def bench_args():
+    parser = ArgumentParser()
+    parser.add_argument('--sizes', help='number of images of the datasets generated', nargs='+', type=int,
+                        default=[1000, 10000])
+    parser.add_argument('--boxes', help='number of boxes per image', type=int, default=4)
+    parser.add_argument('--duplicate_ratio', help='part of the open images copied into another category', type=float,
+                        default=0.1)
+    parser.add_argument('--draw_images', help='number of images drawn by the draw stages', type=int, default=200)
+    parser.add_argument('--image_size', help='width and height of the images generated', nargs=2, type=int,
+                        default=[640, 480])
+    parser.add_argument('--repeat', help='number of runs of every stage, the best time is kept', type=int, default=3)
+    parser.add_argument('--work_dir', help='directory of the datasets generated, a temporary directory by default '
+                                           'removed at the end', type=str)
+    parser.add_argument('--output', help='json file to write the results', type=str)
+    parser.add_argument('--seed', help='seed of the generated datasets', type=int, default=0)
+    parser.add_argument('--baseline', help='json results of a previous run (--output), the stages slower than it '
+                                           'by more than --tolerance are reported and the exit status is 1', type=str)
+    parser.add_argument('--tolerance', help='part of the baseline time a stage can be slower by', type=float,
+                        default=0.2)
+    args = parser.parse_args()
+    return args
+
+
+def image_ids(count):
+    # 16 hexadecimal characters image ids as in open images
+    return [f"{index:016x}" for index in range(count)]
+
+
+def encoded_images(image_size, variants, seed):
+    # a few jpeg encoded images written again and again, generating the pixels of every image would dominate
+    import cv2
+
+    width, height = image_size
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(variants):
+        pixels = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (15, 15), 0)
+        images.append(cv2.imencode('.jpg', pixels)[1].tobytes())
+    return images
+
+
+def random_boxes(rng, count, width, height):
+    # boxes (x1, y1, x2, y2) in pixels inside the image
+    x1 = rng.uniform(0, width * 0.8, count)
+    y1 = rng.uniform(0, height * 0.8, count)
+    x2 = np.minimum(x1 + rng.uniform(10, width * 0.5, count), width - 1)
+    y2 = np.minimum(y1 + rng.uniform(10, height * 0.5, count), height - 1)
+    return np.stack([x1, y1, x2, y2], axis=1)
+
+
+def generate_coco(root, size, boxes, image_size, images, seed):
+    """
+    Generate a coco annotations json and its images directory
+    Args:
+        root: directory where the dataset is generated
+        size: number of images
+        boxes: number of boxes per image
+        image_size: width and height of the images
+        images: list of jpeg encoded images written as the images of the dataset
+        seed: seed of the boxes
+
+    Returns:
+        path to the annotations json, the images directory and the filenames
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    images_dir = os.path.join(root, 'coco', 'images')
+    os.makedirs(images_dir)
+    filenames = [image_id + '.jpg' for image_id in image_ids(size)]
+    categories = [{'id': index + 1, 'name': category} for index, category in enumerate(BENCH_CATEGORIES)]
+    coco_images = []
+    annotations = []
+    for image_id, filename in enumerate(filenames):
+        with open(os.path.join(images_dir, filename), 'wb') as f:
+            f.write(images[image_id % len(images)])
+        coco_images.append({'id': image_id, 'file_name': filename, 'width': width, 'height': height})
+        corners = random_boxes(rng, boxes, width, height)
+        for x1, y1, x2, y2 in corners.tolist():
+            annotations.append({'id': len(annotations), 'image_id': image_id,
+                                'category_id': int(rng.integers(1, len(categories) + 1)),
+                                'bbox': [x1, y1, x2 - x1, y2 - y1], 'area': (x2 - x1) * (y2 - y1), 'iscrowd': 0})
+    annot_path = os.path.join(root, 'coco', 'annotations.json')
+    with open(annot_path, 'w') as f:
+        json.dump({'images': coco_images, 'annotations': annotations, 'categories': categories}, f)
+    return annot_path, images_dir, filenames
+
+
+def generate_open_images(root, size, boxes, duplicate_ratio, image_size, images, seed):
+    """
+    Generate the open images datasets of every category and split with yolo labels, the annotations csv and the
+    label descriptions, every image is in one category and duplicate_ratio of them are copied into another
+    Args:
+        root: directory containing all open images dataset
+        size: number of images
+        boxes: number of boxes per image
+        duplicate_ratio: part of the images copied into another category
+        image_size: width and height of the images
+        images: list of jpeg encoded images written as the images of the datasets
+        seed: seed of the boxes and the placement of the images
+
+    Returns:
+        path to the annotations csv, path to the label descriptions and the filenames
+    """
+    from draw_openimages import construct_path, SPLITS
+    from open_image_dup import get_path
+
+    rng = np.random.default_rng(seed)
+    placement = random.Random(seed)
+    width, height = image_size
+    for split in SPLITS:
+        paths = get_path(split, root, PREFIXE, SUFFIXE, BENCH_CATEGORIES)
+        for category in BENCH_CATEGORIES:
+            path = construct_path(root, PREFIXE, category, split)
+            # the generated layout is the one both tools expect
+            assert os.path.normpath(path) == os.path.normpath(paths[category])
+            os.makedirs(os.path.join(path, 'labels'))
+    annot_path = os.path.join(root, 'annotations-bbox.csv')
+    filenames = []
+    with open(annot_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ImageID', 'Source', 'LabelName', 'Confidence', 'XMin', 'XMax', 'YMin', 'YMax'])
+        for index, image_id in enumerate(image_ids(size)):
+            filename = image_id + '.jpg'
+            filenames.append(filename)
+            split = placement.choice(SPLITS)
+            categories = [placement.choice(BENCH_CATEGORIES)]
+            if placement.random() < duplicate_ratio:
+                categories.append(placement.choice([category for category in BENCH_CATEGORIES
+                                                    if category != categories[0]]))
+            corners = random_boxes(rng, boxes, width, height)
+            classes = rng.integers(0, len(BENCH_CATEGORIES), boxes)
+            label = '\n'.join(f"{class_id} {x1:.1f} {y1:.1f} {x2:.1f} {y2:.1f}"
+                              for class_id, (x1, y1, x2, y2) in zip(classes.tolist(), corners.tolist()))
+            for category in categories:
+                path = construct_path(root, PREFIXE, category, split)
+                with open(os.path.join(path, filename), 'wb') as image_file:
+                    image_file.write(images[index % len(images)])
+                with open(os.path.join(path, 'labels', image_id + '.txt'), 'w') as label_file:
+                    label_file.write(label)
+            for class_id, (x1, y1, x2, y2) in zip(classes.tolist(), corners.tolist()):
+                writer.writerow([image_id, 'xclick', LABEL_IDS[BENCH_CATEGORIES[class_id]], 1,
+                                 x1 / width, x2 / width, y1 / height, y2 / height])
+    label_path = os.path.join(root, 'class-descriptions-boxable.csv')
+    with open(label_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for category in BENCH_CATEGORIES:
+            writer.writerow([LABEL_IDS[category], category.capitalize()])
+    return annot_path, label_path, filenames
+
+
+def measure(func, repeat):
+    """
+    Time func and measure the peak of memory it allocates
+    Args:
+        func: function without argument running the stage, returns the number of items processed
+        repeat: number of timed runs, the best is kept
+
+    Returns:
+        dict with the number of items, the best time in seconds, the throughput and the peak of memory in MB
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # tracemalloc slows the allocations down, the memory is measured on its own run
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'items': items, 'seconds': best, 'items_per_second': items / best if best > 0 else None,
+            'peak_mb': peak / 2 ** 20}
+
+
+def run_size(work_dir, size, args, images):
+    """ generate the datasets of size images and run every stage on them, return the results by stage """
+    from draw_coco import CocoDataset, get_annotation, load_annotations
+    from draw_openimages import (OpenImagesDataset, build_location_index, check_open_annotation, load_open_index,
+                                 CATEGORIES, SPLITS)
+    from open_image_dup import get_path, get_intersection, build_dataframe
+
+    root = os.path.join(work_dir, str(size))
+    start = time.perf_counter()
+    coco_path, images_dir, coco_filenames = generate_coco(root, size, args.boxes, args.image_size, images, args.seed)
+    open_images_path = os.path.join(root, 'open_images')
+    oi_annot_path, label_path, oi_filenames = generate_open_images(open_images_path, size, args.boxes,
+                                                                   args.duplicate_ratio, args.image_size, images,
+                                                                   args.seed)
+    print(f"{size} images generated in {time.perf_counter() - start:.1f}s")
+    draw_filenames = coco_filenames[:args.draw_images]
+    coco = CocoDataset(coco_path, images_dir)
+    open_images_index = load_open_index(oi_annot_path)
+    open_images = OpenImagesDataset(open_images_path, PREFIXE, oi_annot_path, label_path)
+    yolo = OpenImagesDataset(open_images_path, PREFIXE, path_label_ID=label_path)
+    yolo_bulk = OpenImagesDataset(open_images_path, PREFIXE, path_label_ID=label_path, bulk_labels=True)
+    label_id = dict(LABEL_IDS)
+
+    def load_coco(stream):
+        load_annotations(coco_path, None, stream)
+        return size
+
+    def render(dataset):
+        for fn in draw_filenames:
+            dataset.render(fn)
+        return len(draw_filenames)
+
+    def scan_duplicates():
+        for split in SPLITS:
+            paths = get_path(split, open_images_path, PREFIXE, SUFFIXE, BENCH_CATEGORIES)
+            members = {}
+            intersection = get_intersection(paths, members=members)
+            if len(intersection) > 0:
+                build_dataframe(intersection, paths, label_id, members)
+        return size
+
+    stages = {
+        'coco_load': lambda: load_coco(False),
+        'coco_stream_load': lambda: load_coco(True),
+        'coco_lookup': lambda: sum(get_annotation(fn, coco.annot_index)[0] for fn in coco_filenames),
+        'coco_draw': lambda: render(coco),
+        'open_images_load': lambda: len(load_open_index(oi_annot_path)),
+        'open_images_lookup': lambda: sum(check_open_annotation(open_images_index, os.path.splitext(fn)[0])
+                                          for fn in oi_filenames),
+        'open_images_locate': lambda: len(build_location_index(open_images_path, CATEGORIES, SPLITS, PREFIXE)),
+        'open_images_draw': lambda: render(open_images),
+        'yolo_draw': lambda: render(yolo),
+        'yolo_bulk_draw': lambda: render(yolo_bulk),
+        'duplicate_scan': scan_duplicates,
+    }
+    results = {}
+    for name, stage in stages.items():
+        results[name] = measure(stage, args.repeat)
+    return results
+
+
+def print_results(results):
+    print(f"{'size':>8} {'stage':<20} {'items':>8} {'seconds':>10} {'items/s':>12} {'peak MB':>9}")
+    for size, stages in results.items():
+        for name, result in stages.items():
+            rate = result['items_per_second']
+            print(f"{size:>8} {name:<20} {result['items']:>8} {result['seconds']:>10.4f} "
+                  f"{rate if rate is not None else float('nan'):>12.1f} {result['peak_mb']:>9.2f}")
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare the times of the stages to the ones of a previous run
+    Args:
+        results: dict mapping size to the results of every stage
+        baseline: content of the json written by --output of a previous run
+        tolerance: part of the baseline time a stage can be slower by
+
+    Returns:
+        list of (size, stage, baseline seconds, seconds) of the stages slower than the baseline by more than
+        tolerance and NOISE_SECONDS, only the sizes and stages run by both are compared
+    """
+    regressions = []
+    for size, stages in results.items():
+        # the sizes are the keys of the json, so strings
+        baseline_stages = baseline['results'].get(str(size), {})
+        for name, result in stages.items():
+            if name not in baseline_stages:
+                continue
+            baseline_seconds = baseline_stages[name]['seconds']
+            if result['seconds'] - baseline_seconds > max(baseline_seconds * tolerance, NOISE_SECONDS):
+                regressions.append((size, name, baseline_seconds, result['seconds']))
+    return regressions
+
+
+def print_regressions(regressions, tolerance):
+    if len(regressions) == 0:
+        print(f"no stage slower than the baseline by more than {tolerance:.0%}")
+        return
+    print(f"{len(regressions)} stages slower than the baseline by more than {tolerance:.0%}:")
+    for size, name, baseline_seconds, seconds in regressions:
+        print(f"{size:>8} {name:<20} {baseline_seconds * 1000:>10.3f} -> {seconds * 1000:.3f} ms "
+              f"({seconds / baseline_seconds:.2f}x)")
+
+
+def main(sizes, args):
+    """
+    Generate the datasets of every size, run the stages and report their time, throughput and peak memory
+    Args:
+        sizes: list of numbers of images
+        args: options of the benchmark (see bench_args)
+
+    Returns:
+        dict mapping size to the results of every stage
+    """
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_')
+    images = encoded_images(args.image_size, 8, args.seed)
+    results = {}
+    try:
+        for size in sizes:
+            if os.path.exists(os.path.join(work_dir, str(size))):
+                shutil.rmtree(os.path.join(work_dir, str(size)))
+            results[size] = run_size(work_dir, size, args, images)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    args = bench_args()
+    results = main(args.sizes, args)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sizes': args.sizes, 'boxes': args.boxes, 'draw_images': args.draw_images,
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        for option in ['boxes', 'draw_images']:
+            if baseline.get(option) != getattr(args, option):
+                logging.warning(f"baseline run with {option} {baseline.get(option)}, the times may not be comparable")
+        regressions = compare_results(results, baseline, args.tolerance)
+        print_regressions(regressions, args.tolerance)
+        if len(regressions) > 0:
+            sys.exit(1)
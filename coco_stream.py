@@ -0,0 +1,180 @@
+"""
+Streaming loader for huge coco annotation files.
+The json file is read by chunks and the elements of the images, annotations and categories arrays are decoded
+one by one, only the fields needed to draw are kept into compact columnar arrays (int32 ids, float32 bboxes)
+"""
+import json
+from array import array
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+_WHITESPACE = ' \t\n\r'
+
+
+class _JsonStream:
+    # buffered reader decoding one json value at a time from a file object
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop the part of the buffer already decoded
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # return the next non whitespace character without consuming it, '' at the end of file
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read_more():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError(f"invalid coco json: expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        # decode the next json value, reading more data while the value is truncated by the buffer end
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # a number ending with the buffer may continue into the next chunk
+            if end == len(self.buf) and not self.eof and self._read_more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_coco(f, keys=('images', 'annotations', 'categories'), chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the elements of the top level arrays of a coco json file without loading the whole file
+    Args:
+        f: file object opened in text mode
+        keys: top level keys whose array elements are yielded, other keys are decoded and skipped
+        chunk_size: number of characters read at once
+
+    Returns:
+        generator of (key, element) in the file order
+    """
+    stream = _JsonStream(f, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key in keys and stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield key, stream.value()
+                    if stream.expect(',]') == ']':
+                        break
+        else:
+            stream.value()
+        if stream.expect(',}') == '}':
+            return
+
+
+def load_coco_streaming(annot_path, filenames=None, chunk_size=CHUNK_SIZE):
+    """
+    Load the coco annotation file by streaming into compact arrays and build the index file_name -> annotations
+    Args:
+        annot_path: path to annotation at coco format
+        filenames: if given, keep only the annotations of those filenames
+        chunk_size: number of characters read at once
+
+    Returns:
+        annotation index, dict mapping file_name to a tuple (bboxes float32 array (N, 4), category_id int32 array (N,))
+        categories, list of dict with id and name
+    """
+    wanted = set(filenames) if filenames is not None else None
+    image_ids = array('i')
+    image_names = []
+    annot_image_ids = array('i')
+    annot_category_ids = array('i')
+    annot_bboxes = array('f')
+    categories = []
+    # ids of the wanted images, known only if the images are before the annotations in the file
+    wanted_ids = None
+    images_seen = False
+    with open(annot_path, 'r') as f:
+        for key, element in iter_coco(f, chunk_size=chunk_size):
+            if key == 'images':
+                images_seen = True
+                if wanted is None or element['file_name'] in wanted:
+                    image_ids.append(element['id'])
+                    image_names.append(element['file_name'])
+            elif key == 'annotations':
+                if wanted_ids is None and wanted is not None and images_seen:
+                    wanted_ids = set(image_ids)
+                if wanted_ids is not None and element['image_id'] not in wanted_ids:
+                    continue
+                annot_image_ids.append(element['image_id'])
+                annot_category_ids.append(element['category_id'])
+                annot_bboxes.extend(element['bbox'][:4])
+            elif key == 'categories':
+                categories.append({'id': element['id'], 'name': element['name']})
+    annot_index = index_from_arrays(np.frombuffer(image_ids, dtype=np.int32), image_names,
+                                    np.frombuffer(annot_image_ids, dtype=np.int32),
+                                    np.frombuffer(annot_bboxes, dtype=np.float32).reshape(-1, 4),
+                                    np.frombuffer(annot_category_ids, dtype=np.int32))
+    return annot_index, categories
+
+
+def index_from_arrays(image_ids, image_names, annot_image_ids, bboxes, category_ids):
+    """
+    Group columnar annotations by file_name, merging the annotations of every image id with the same file_name
+    Args:
+        image_ids: array of the images id
+        image_names: file_name of every image id
+        annot_image_ids: image id of every annotation
+        bboxes: array (N, 4) of the annotations bbox
+        category_ids: array (N,) of the annotations category id
+
+    Returns:
+        dict mapping file_name to a tuple (bboxes array, category_id array) in the original annotations order
+    """
+    if len(image_ids) == 0 or len(annot_image_ids) == 0:
+        return {}
+    # code of the file_name of every image, images with the same file_name share the code
+    names, image_codes = np.unique(np.asarray(image_names, dtype=object), return_inverse=True)
+    # find the image of every annotation by binary search on the sorted image ids
+    order = np.argsort(image_ids, kind='stable')
+    sorted_ids = image_ids[order]
+    position = np.minimum(np.searchsorted(sorted_ids, annot_image_ids), len(sorted_ids) - 1)
+    found = sorted_ids[position] == annot_image_ids
+    annot_codes = image_codes[order][position][found]
+    rows = np.flatnonzero(found)
+    if len(rows) == 0:
+        return {}
+    # sort annotations by file_name code and cut the groups
+    rows = rows[np.argsort(annot_codes, kind='stable')]
+    annot_codes = np.sort(annot_codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, annot_codes[1:] != annot_codes[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    return {names[annot_codes[start]]: (bboxes[rows[start:end]], category_ids[rows[start:end]])
+            for start, end in zip(starts, ends)}
@@ -0,0 +1,215 @@
+"""
+Find duplicated images of the open images datasets by their content instead of their filename,
+so renamed copies are found too.
+Files are first grouped by size, then by a hash of their first and last bytes, the full digest is computed only
+for the files still sharing a group. Optionally a perceptual hash (dHash) groups the re-encoded near duplicates.
+The images of the tar/zip shards are hashed from their members, with the mtime of their shard
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from scan_manifest import scan_directory
+from shards import is_shard, get_shard, is_member_path, read_bytes, open_file
+
+PARTIAL_SIZE = 1 << 16
+BLOCK_SIZE = 1 << 20
+CSV_COLUMNS = ['filename', 'path', 'label', 'ID_label', 'match_type']
+
+
+def list_dataset_files(paths_by_split, manifest=None):
+    """
+    List the images of every dataset with their size and modification time
+    Args:
+        paths_by_split: dict mapping split to a dict category -> path of its open-images dataset
+        manifest: scan manifest, if given only the directories modified since the previous run are listed
+
+    Returns:
+        list of dict with path, filename, category, split, size and mtime of every image
+    """
+    files = []
+    for split, paths in paths_by_split.items():
+        for category, path in paths.items():
+            if manifest is not None:
+                directory_files, _ = scan_directory(path, manifest, with_stat=True)
+                members = manifest['dirs'].get(path, {}).get('members', {})
+                for name, (size, mtime) in directory_files.items():
+                    files.append({'path': members.get(name, os.path.join(path, name)), 'filename': name,
+                                  'category': category, 'split': split, 'size': size, 'mtime': mtime})
+                continue
+            if not os.path.isdir(path):
+                continue
+            shard_paths = []
+            names = set()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    if is_shard(entry.name):
+                        shard_paths.append(entry.path)
+                        continue
+                    stat = entry.stat()
+                    names.add(entry.name)
+                    files.append({'path': entry.path, 'filename': entry.name, 'category': category,
+                                  'split': split, 'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+            for shard_path in sorted(shard_paths):
+                shard = get_shard(shard_path)
+                for name, member in shard.images():
+                    # as scan_directory, a loose image or the image of a previous shard keeps its place
+                    if name not in names:
+                        names.add(name)
+                        files.append({'path': os.path.join(shard_path, member), 'filename': name,
+                                      'category': category, 'split': split, 'size': shard.members[member],
+                                      'mtime': shard.mtime})
+    files.sort(key=lambda file: file['path'])
+    return files
+
+
+def partial_hash(path, size):
+    # hash of the first and last PARTIAL_SIZE bytes, the whole file for small files
+    digest = hashlib.blake2b(digest_size=16)
+    with open_file(path) as f:
+        digest.update(f.read(PARTIAL_SIZE))
+        if size > 2 * PARTIAL_SIZE:
+            f.seek(-PARTIAL_SIZE, os.SEEK_END)
+        digest.update(f.read(PARTIAL_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    # digest of the whole file read by blocks
+    digest = hashlib.blake2b(digest_size=32)
+    with open_file(path) as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path):
+    # 64 bits difference hash of the image, equal for re-encoded or resized copies
+    import cv2
+    import numpy as np
+
+    if is_member_path(path):
+        image = cv2.imdecode(np.frombuffer(read_bytes(path), dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    else:
+        image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return '%016x' % int(np.packbits(bits).view('>u8')[0])
+
+
+def load_hash_cache(hash_cache):
+    # fingerprints of the previous runs, path -> dict of size, mtime and the computed hashes
+    if hash_cache and os.path.isfile(hash_cache):
+        with open(hash_cache, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_hash_cache(hash_cache, cache):
+    directory = os.path.dirname(os.path.abspath(hash_cache))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, hash_cache)
+
+
+def _compute(files, kind, func, cache, executor):
+    # compute the hash kind of files on the thread pool, reusing the value of the cache if the file is unchanged
+    todo = []
+    for file in files:
+        cached = cache.get(file['path'])
+        if cached and cached['size'] == file['size'] and cached['mtime'] == file['mtime'] and kind in cached:
+            file[kind] = cached[kind]
+        else:
+            todo.append(file)
+    for file, value in zip(todo, executor.map(func, todo)):
+        file[kind] = value
+        cached = cache.get(file['path'])
+        if not cached or cached['size'] != file['size'] or cached['mtime'] != file['mtime']:
+            cached = cache[file['path']] = {'size': file['size'], 'mtime': file['mtime']}
+        cached[kind] = value
+
+
+def _groups(files, key):
+    # groups of more than one file sharing the same key
+    groups = {}
+    for file in files:
+        groups.setdefault(key(file), []).append(file)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_content_duplicates(files, workers=8, cache=None, perceptual=False):
+    """
+    Group the files having the same content
+    Args:
+        files: list of dict from list_dataset_files
+        workers: number of threads reading and hashing the files
+        cache: dict of the fingerprints of the previous runs, only new or modified files are hashed,
+            updated with the new fingerprints and without the files that no longer exist
+        perceptual: if True also group the near duplicates by perceptual hash (needs opencv)
+
+    Returns:
+        list of (match_type, list of files) with match_type content or perceptual, the groups whose files all have
+        the same filename in one split are left out as they are the filename duplicates
+    """
+    if cache is None:
+        cache = {}
+    result = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # only files with the same size can have the same content
+        candidates = [file for group in _groups(files, lambda file: file['size']) for file in group]
+        _compute(candidates, 'partial', lambda file: partial_hash(file['path'], file['size']), cache, executor)
+        candidates = [file for group in _groups(candidates, lambda file: (file['size'], file['partial']))
+                      for file in group]
+        # for small files the partial hash already covers the whole file
+        _compute([file for file in candidates if file['size'] > 2 * PARTIAL_SIZE], 'full',
+                 lambda file: full_hash(file['path']), cache, executor)
+        content_groups = _groups(candidates, lambda file: (file['size'], file['partial'], file.get('full')))
+        content_id = {}
+        for group_id, group in enumerate(content_groups):
+            # copies with the same filename in the categories of one split are already a filename duplicate
+            if len({(file['filename'], file['split']) for file in group}) > 1:
+                result.append(('content', group))
+            for file in group:
+                content_id[file['path']] = group_id
+        if perceptual:
+            _compute(files, 'phash', lambda file: perceptual_hash(file['path']), cache, executor)
+            for group in _groups([file for file in files if file['phash'] is not None], lambda file: file['phash']):
+                # keep only the groups that are not already a group of identical content
+                ids = {content_id.get(file['path'], file['path']) for file in group}
+                if len(ids) > 1 and len({(file['filename'], file['split']) for file in group}) > 1:
+                    result.append(('perceptual', group))
+    for path in set(cache).difference(file['path'] for file in files):
+        del cache[path]
+    logging.info(f"{len(files)} files listed, {len(result)} groups of duplicated content found")
+    return sorted(result, key=lambda item: (item[0], item[1][0]['path']))
+
+
+def build_content_dataframe(groups, label_id):
+    """
+    Build the dataframe of duplicate with the columns of the filename duplicates and the match_type
+    Args:
+        groups: list of (match_type, list of files) from find_content_duplicates
+        label_id: dict mapping category to the ID of the label
+
+    Returns:
+        dataframe with filename, path, label, ID_label and match_type columns
+    """
+    import pandas as pd
+
+    rows = []
+    for match_type, group in groups:
+        rows.append({'filename': group[0]['filename'],
+                     'path': [file['path'] for file in group],
+                     'label': [file['category'] for file in group],
+                     'ID_label': [label_id.get(file['category']) for file in group],
+                     'match_type': match_type})
+    return pd.DataFrame(rows, columns=CSV_COLUMNS)
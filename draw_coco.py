@@ -1,148 +1,235 @@
 import os
 from argparse import ArgumentParser
-from ast import literal_eval
 import json
-from pathlib import Path
-import cv2
-import pandas as pd
+import numpy as np
 import logging
-from datetime import datetime
+from label_mapping import coco_label_map, resolve_label
+from annotation_store import is_store, store_index
+from draw_core import get_filenames, draw_bboxes, output_batch, load_image
+from logging_setup import setup_logging
+from stage_timing import stage, collect_stages, run_summary, emit_summary, merge_profiles
 import sys
-
-date = datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p")
-
-FORMAT = '%(asctime)s %(message)s'
-logging.basicConfig(format=FORMAT,
-                    filename=f"logs/logs_coco/log_draw_{date}",
-                    filemode='a',
-                    datefmt='%H:%M:%S',
-                    level=logging.DEBUG)
-
-console = logging.StreamHandler()
-console.setLevel(logging.DEBUG)
-# add the handler to the root logger
-logging.getLogger('').addHandler(console)
+import time
 
 
 def draw_args():
     parser = ArgumentParser()
-    parser.add_argument('annot_path', help='path to annotation at coco format', type=str)
+    parser.add_argument('annot_path', help='path to annotation at coco format, or to the parquet annotation store',
+                        type=str)
     parser.add_argument('images_dir', help='path to images', type=str)
     parser.add_argument('--output_dir', help='path to store output', type=str)
     parser.add_argument('--input_dir', help='path to images directory ', type=str)
     parser.add_argument('--from_csv', help='path to csv that contains filenames', type=str)
     parser.add_argument('--show', help='if True display image on screen', type=bool)
     parser.add_argument('--filename_list', nargs="+")
+    parser.add_argument('--stream', help='stream the annotation file into compact arrays keeping only the '
+                                         'annotations of the images to draw, for huge coco files',
+                        action='store_true')
+    parser.add_argument('--cache_dir', help='directory of the annotations cache, the parsed annotations are '
+                                            'stored there and reused while the annotation file is unchanged',
+                        type=str)
+    parser.add_argument('--workers', help='number of processes drawing images in parallel', type=int, default=1)
+    parser.add_argument('--max_size', help='preview mode, the images are decoded at reduced resolution and saved '
+                                           'with their largest side at most max_size pixels', type=int)
+    parser.add_argument('--summary', help='path to write the json summary of the run (stage timings, histograms)',
+                        type=str)
+    parser.add_argument('--profile_dir', help='profile about one image out of --profile_every with cProfile, '
+                                              'the profiles are written into this directory and merged', type=str)
+    parser.add_argument('--profile_every', help='sampling of the profiled images', type=int, default=100)
+    parser.add_argument('--jpeg_quality', help='quality (0-100) of the jpeg images saved, default 85 with --max_size '
+                                               'and 95 otherwise', type=int)
+    parser.add_argument('--prefetch', help='number of images read and decoded ahead on threads while the current '
+                                           'one is drawn (ignored with --workers)', type=int)
+    parser.add_argument('--prefetch_threads', help='number of threads reading ahead, default --prefetch', type=int)
 
     args = parser.parse_args()
     return args
 
 
-def get_annotation(img_name, images_coco, annot_coco):
-    # get all image_id for same filename
-    row_img = images_coco[images_coco['file_name'] == img_name]
-    if len(row_img.index) == 1:
-        id_img = row_img.loc[row_img.index[0], 'id']
-        # get annotations
-        annot = annot_coco[annot_coco['image_id'] == id_img]
-    else:
-        # if len >1 means that there is multiple id for the same filename (duplicate)
-        # merge annotations of all id
-        list_id = set(row_img['id'])
-        annot = pd.DataFrame(
-            columns=['segmentation', 'iscrowd', 'area', 'image_id', 'bbox', 'category_id', 'id'])
-        for i in list_id:
-            annot = pd.concat([annot, annot_coco[annot_coco['image_id'] == i]])
-    if len(annot) == 0:
+def build_annotation_index(images_coco, annot_coco):
+    """
+    Build once the lookup table file_name -> annotations, merging the annotations of every image id
+    that share the same file_name (duplicate)
+    Args:
+        images_coco: dataframe of the coco images
+        annot_coco: dataframe of the coco annotations
+
+    Returns:
+        dict mapping file_name to a tuple (bboxes array of shape (N, 4), category_id array of shape (N,))
+    """
+    import pandas as pd
+
+    if len(annot_coco.index) == 0 or len(images_coco.index) == 0:
+        return {}
+    # file_name of the image of every annotation, image ids are unique in coco
+    id_to_name = pd.Series(images_coco['file_name'].values, index=images_coco['id'].values)
+    id_to_name = id_to_name[~id_to_name.index.duplicated()]
+    annot_names = annot_coco['image_id'].map(id_to_name)
+    bboxes = np.asarray(annot_coco['bbox'].tolist(), dtype=np.float64).reshape(-1, 4)
+    category_ids = annot_coco['category_id'].to_numpy()
+    # group the rows positions by file_name keeping the original order of the annotations
+    groups = annot_names.groupby(annot_names.values, sort=False).indices
+    return {name: (bboxes[rows], category_ids[rows]) for name, rows in groups.items()}
+
+
+def get_annotation(img_name, annot_index):
+    # get annotations of all image_id for same filename
+    annot = annot_index.get(img_name)
+    if annot is None:
         logging.info(f"image {img_name} has no annotations")
-        value = False
-    else:
-        value = True
-    return value, annot
-
-
-def draw_bboxes(image, boxes, label):
-    # function that draw bounding boxes onto the image given and add score, category
-    [x1, y1, w, h] = [int(boxes[0]), int(boxes[1]), int(boxes[2]), int(boxes[3])]
-    c1 = (x1, y1)
-    c2 = (x1 + w, y1 + h)
-    cv2.rectangle(image, c1, c2, (255, 0, 0), 3)
-    # if the text is out of image bounding , replace it
-    if y1 < 30:
-        yput_text = y1 + 15
-    else:
-        yput_text = y1 - 10
-    cv2.putText(image, label, (x1, yput_text),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (36, 255, 12), 2)
-
-
-def get_filenames(filename_list, from_csv, input_dir):
-    # get the filenames list from the possible argument
-    if filename_list:
-        filenames = filename_list
-    elif from_csv:
-        filelist_csv = pd.read_csv(from_csv)
-        filenames = list(filelist_csv['file_name'])
-    elif input_dir:
-        filenames = [file for file in os.listdir(input_dir)]
-        if 'labels' in filenames:
-            filenames.remove('labels')
-    else:
-        logging.error('no input data you have to give one of this three argument (input_dir, filename_list, from_csv')
-        sys.exit()
-    if len(filenames) == 0:
-        logging.error("no image in directory")
-        sys.exit()
-    return filenames
+        return False, None
+    return True, annot
+
 
+def coco_corners(boxes):
+    # convert coco boxes (x, y, w, h) into corners (x1, y1, x2, y2) in integer pixels
+    boxes = np.asarray(boxes).reshape(-1, 4).astype(int)
+    return np.stack([boxes[:, 0], boxes[:, 1], boxes[:, 0] + boxes[:, 2], boxes[:, 1] + boxes[:, 3]], axis=1)
 
-def main(annot_path, output_dir, images_dir, filename_list, from_csv, input_dir, show):
+
+def load_store_annotations(store, filenames):
+    """ annotation index of the coco rows of the annotation store, only the row groups of filenames are read (all
+    if None), the boxes are read as the (x, y, w, h) of the coco json with the category name as category """
+    with stage('load'):
+        return store_index(store, 'file_name', filenames, ['coco'], ['x1', 'y1', 'w', 'h']), []
+
+
+def load_annotations(annot_path, filenames, stream):
+    """
+    Load the coco annotations file and build the annotation index
+    Args:
+        annot_path: path to annotation at coco format
+        filenames: with stream, keep only the annotations of those filenames (all if None)
+        stream: if True read the file by chunks into compact arrays
+
+    Returns:
+        the annotation index and the coco categories
+    """
+    # heavy modules are imported only by the loading mode that needs them
+    if stream:
+        from coco_stream import load_coco_streaming
+
+        # the index is built while the file is read
+        with stage('load'):
+            return load_coco_streaming(annot_path, filenames)
+    import pandas as pd
+
+    with stage('load'):
+        with open(annot_path, 'r') as f:
+            data = json.load(f)
+    with stage('index'):
+        images_coco = pd.DataFrame.from_dict(data['images'])
+        annot_coco = pd.DataFrame.from_dict(data['annotations'])
+        return build_annotation_index(images_coco, annot_coco), data['categories']
+
+
+class CocoDataset:
+    """
+    Coco annotations loaded once with the images directory, render draws the annotations of one image
+    Args:
+        annot_path: path to annotation at coco format
+        images_dir: path to images
+        filenames: with stream, keep only the annotations of those filenames (all if None)
+        stream: if True read the annotation file by chunks into compact arrays
+        cache_dir: directory of the annotations cache, the index is built and stored the first time
+        max_size: if given the images are rendered as previews with their largest side at most max_size pixels
+    annot_path can also be the parquet annotation store of annotation_store.py, only the rows of filenames are read
+    """
+
+    def __init__(self, annot_path, images_dir, filenames=None, stream=False, cache_dir=None, max_size=None):
+        self.images_dir = images_dir
+        self.max_size = max_size
+        if is_store(annot_path):
+            self.annot_index, categories = load_store_annotations(annot_path, filenames)
+        elif cache_dir:
+            from annotation_cache import cached_index
+
+            # the cache keeps the annotations of all images, reused by the next runs whatever the filenames
+            self.annot_index, categories = cached_index(cache_dir, annot_path, 'coco',
+                                                        lambda: load_annotations(annot_path, None, stream))
+        else:
+            self.annot_index, categories = load_annotations(annot_path, filenames, stream)
+        self.label_map = coco_label_map(categories)
+
+    def output_name(self, fn):
+        return fn
+
+    def image_path(self, fn):
+        # path of the image fn, None if it is not in the images directory
+        filepath = os.path.join(self.images_dir, fn)
+        return filepath if os.path.isfile(filepath) else None
+
+    def render(self, fn, reuse_buffer=False, loaded=None):
+        """ read the image fn and draw all its annotations, return None if not found or without annotations
+        with reuse_buffer the image is decoded into the buffer of the previous image rendered
+        loaded is the image and scale already read by the prefetch, (None, None) if it was not found """
+        # check if images from annotations are in the directory
+        filepath = os.path.join(self.images_dir, fn)
+        if loaded is not None:
+            found = loaded[0] is not None
+        else:
+            with stage('locate'):
+                found = os.path.isfile(filepath)
+        if not found:
+            logging.info(f"image: {fn} is not in directory {self.images_dir} ")
+            return None
+        # check if image fn has annotations, if yes get it
+        with stage('annotate'):
+            value, annot = get_annotation(fn, self.annot_index)
+            if value:
+                bboxes, category_ids = annot
+                corners = coco_corners(bboxes)
+                labels = [resolve_label(self.label_map, category_id) for category_id in category_ids]
+        if not value:
+            logging.info(f"image: {fn} has no annotations")
+            return None
+        if loaded is not None:
+            image, scale = loaded
+        else:
+            with stage('read'):
+                image, scale = load_image(filepath, reuse_buffer, self.max_size)
+        if image is None:
+            logging.error(f"image: {filepath} can not be read")
+            return None
+        with stage('draw'):
+            draw_bboxes(image, corners, labels, scale)
+        return image
+
+
+def main(annot_path, output_dir, images_dir, filename_list, from_csv, input_dir, show, workers=None, stream=False,
+         cache_dir=None, max_size=None, jpeg_quality=None, summary=None, profile_dir=None, profile_every=100,
+         prefetch=None, prefetch_threads=None):
     """
     main functions that get filenames list then load coco annotations file,
     loop into filename_list and get all annotations for the same filename taking in account the duplicate, and draw bboxes
+    with workers > 1 the images are drawn in parallel on a pool of processes
+    with stream the annotation file is streamed keeping only the annotations of the filenames list
+    with cache_dir the annotation index is read from the cache, built and stored the first time
+    with max_size the images are saved as previews downscaled at decode, jpeg_quality sets the quality of the output
+    at the end the timings of every stage are logged as json and written into summary if given,
+    with profile_dir about one image out of profile_every is profiled
+    with prefetch the next images are read and decoded on prefetch_threads threads while the current one is drawn
     """
+    start = time.perf_counter()
+    collect_stages()
     if not os.path.isdir(images_dir):
         logging.error(f"{images_dir} does not exist")
         sys.exit()
 
-    if output_dir and not os.path.exists(output_dir):
-        print('creating dir')
-        os.makedirs(output_dir)
     # get  filenames list
     filenames = get_filenames(filename_list, from_csv, input_dir)
     # load annotations
-    with open(annot_path, 'r') as f:
-        data = json.load(f)
-    images_coco = pd.DataFrame.from_dict(data['images'])
-    annot_coco = pd.DataFrame.from_dict(data['annotations'])
-    categories = pd.DataFrame.from_dict(data['categories'])
-    # check if images from annotations are in the directory
-    for fn in filenames:
-        filepath = os.path.join(images_dir, fn)
-        if not os.path.isfile(filepath):
-            logging.info(f"image: {fn} is not in directory {images_dir} ")
-            continue
-        # check if image fn has annotations, if yes get it
-        value, annot = get_annotation(fn, images_coco, annot_coco)
-        if value:
-            image = cv2.imread(filepath)
-            for index, raw in annot.iterrows():
-                bboxes = raw['bbox']
-                category_id = raw['category_id']
-                label = categories[categories['id'] == category_id]['name'].values[0]
-                draw_bboxes(image, bboxes, label)
-            if output_dir:
-                output_path = os.path.join(output_dir, fn)
-                cv2.imwrite(output_path, image)
-                # show image drawn
-            if show:
-                cv2.imshow('image', image)
-                cv2.waitKey(0)
-        else:
-            logging.info(f"image: {fn} has no annotations")
+    dataset = CocoDataset(annot_path, images_dir, filenames, stream, cache_dir, max_size)
+    drawn = output_batch(dataset, filenames, output_dir, show, workers, jpeg_quality, profile_dir, profile_every,
+                         prefetch, prefetch_threads)
+    emit_summary(run_summary(len(filenames), drawn, time.perf_counter() - start), summary)
+    merged = merge_profiles(profile_dir)
+    if merged:
+        logging.info(f"profiles of the sampled images merged into {merged}")
 
 
 if __name__ == "__main__":
+    setup_logging('logs/logs_coco')
     args = draw_args()
     annot_path = args.annot_path
     output_dir = args.output_dir
@@ -151,5 +238,16 @@ if __name__ == "__main__":
     from_csv = args.from_csv
     input_dir = args.input_dir
     show = args.show
-
-    main(annot_path, output_dir, images_dir, filename_list, from_csv, input_dir, show)
+    workers = args.workers
+    stream = args.stream
+    cache_dir = args.cache_dir
+    max_size = args.max_size
+    jpeg_quality = args.jpeg_quality
+    summary = args.summary
+    profile_dir = args.profile_dir
+    profile_every = args.profile_every
+    prefetch = args.prefetch
+    prefetch_threads = args.prefetch_threads
+
+    main(annot_path, output_dir, images_dir, filename_list, from_csv, input_dir, show, workers, stream, cache_dir,
+         max_size, jpeg_quality, summary, profile_dir, profile_every, prefetch, prefetch_threads)
@@ -0,0 +1,333 @@
+"""
+Shared core of the draw functions (draw_coco.py, draw_openimages.py): filenames input, drawing of the bboxes,
+save/show of the images drawn and the batch rendering API.
+A dataset (draw_coco.CocoDataset, draw_openimages.OpenImagesDataset) loads its annotations index once,
+render_batch can then be called many times from a long running process without loading them again.
+Importing this module has no side effect and opencv is imported only when an image is drawn
+"""
+import csv
+import io
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+from parallel_draw import run_parallel
+from prefetch import prefetch
+from shards import is_member_path, read_bytes
+from stage_timing import stage, collect_stages, drain, record, profiled
+
+BOX_COLOR = (255, 0, 0)
+BOX_THICKNESS = 3
+TEXT_COLOR = (36, 255, 12)
+TEXT_SCALE = 0.6
+TEXT_THICKNESS = 2
+# jpeg quality of the images saved in preview mode (max_size) when no quality is given
+PREVIEW_JPEG_QUALITY = 85
+# jpeg markers of the start of frame segments holding the image size
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# image buffer of the process reused by the next image read
+_image_buffer = {'image': None, 'reuse': True}
+# first bytes written into the reused buffer before a read, still there if the decoder did not write the image
+_BUFFER_CANARY = np.array([0x5A, 0xA5, 0x3C, 0xC3, 0x96, 0x69, 0x0F, 0xF0], dtype=np.uint8)
+
+
+def get_filenames(filename_list, from_csv, input_dir):
+    # get the filenames list from the possible argument
+    if filename_list:
+        filenames = filename_list
+    elif from_csv:
+        with open(from_csv, 'r', newline='') as f:
+            filenames = [row['file_name'] for row in csv.DictReader(f)]
+    elif input_dir:
+        filenames = [file for file in os.listdir(input_dir)]
+        # remove directory labels
+        if 'labels' in filenames:
+            filenames.remove('labels')
+    else:
+        logging.error('no input data you have to give one of this three argument (input_dir, filename_list, from_csv')
+        sys.exit()
+    if len(filenames) == 0:
+        logging.error("no image in directory")
+        sys.exit()
+    return filenames
+
+
+def draw_bboxes_indexed(image, corners, label_indices, label_names):
+    """
+    Draw all the boxes onto the image at once: the coordinates are converted in one array operation,
+    every rectangle is drawn by a single polylines call, then the labels are written over the rectangles
+    Args:
+        image: BGR image drawn in place
+        corners: array (N, 4) of boxes (x1, y1, x2, y2) in pixels
+        label_indices: array (N,) index of the label of every box into label_names
+        label_names: names of the labels
+    """
+    import cv2
+
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4)
+    if len(corners) == 0:
+        return
+    # truncate the coordinates as int() did
+    x1, y1, x2, y2 = corners.astype(np.int64).T
+    polygons = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y2], 1),
+                         np.stack([x1, y2], 1)], axis=1).astype(np.int32)
+    cv2.polylines(image, list(polygons), True, BOX_COLOR, BOX_THICKNESS)
+    # if the text is out of image bounding , replace it
+    text_y = np.where(y1 < 30, y1 + 15, y1 - 10)
+    label_names = [str(name) for name in label_names]
+    for x, y, index in zip(x1.tolist(), text_y.tolist(), np.asarray(label_indices).tolist()):
+        cv2.putText(image, label_names[index], (x, y), cv2.FONT_HERSHEY_SIMPLEX, TEXT_SCALE, TEXT_COLOR,
+                    TEXT_THICKNESS)
+
+
+def draw_bboxes(image, corners, labels, scale=None):
+    # draw every box (x1, y1, x2, y2) of corners with its label, corners are multiplied by scale (sx, sy) if given
+    if scale is not None:
+        sx, sy = scale
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4) * np.array([sx, sy, sx, sy])
+    draw_bboxes_indexed(image, corners, np.arange(len(labels)), labels)
+
+
+def decode_image(data, flags=None):
+    # decode the image from its encoded bytes in memory, None if they are not a valid image
+    import cv2
+
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def read_image(path, reuse_buffer=False, flags=None):
+    """ read the image, a loose file or a member of a shard, with reuse_buffer the pixels are decoded
+    into the buffer of the previous image when it has the same shape, the previous image must no longer be used """
+    import cv2
+
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    if is_member_path(path):
+        # shard members are decoded from memory, imdecode has no destination buffer
+        return decode_image(read_bytes(path), flags)
+    if reuse_buffer and _image_buffer['reuse'] and _image_buffer['image'] is not None:
+        buffer = _image_buffer['image']
+        # imread leaves the destination unchanged when the file can not be decoded, the canary written into the
+        # buffer tells a decoded image from the previous one
+        canary = buffer.reshape(-1)[:len(_BUFFER_CANARY)]
+        canary[:] = _BUFFER_CANARY[:len(canary)]
+        try:
+            image = cv2.imread(path, buffer, flags)
+        except (cv2.error, TypeError):
+            # opencv without the imread overload taking the destination
+            _image_buffer['reuse'] = False
+            image = cv2.imread(path, flags)
+        else:
+            if image is buffer and np.array_equal(canary, _BUFFER_CANARY[:len(canary)]):
+                # not decoded, or an image starting with the canary: read it again without the buffer
+                image = cv2.imread(path, flags)
+    else:
+        image = cv2.imread(path, flags)
+    if reuse_buffer and image is not None and image.size > 0:
+        _image_buffer['image'] = image
+    if image is not None and image.size == 0:
+        return None
+    return image
+
+
+def jpeg_size(f):
+    """ width and height of a jpeg image read from the header of the binary file f, None if it is not a jpeg """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] == 0xFF:
+            # fill byte before the marker
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if 0xD0 <= marker[1] <= 0xD9 or marker[1] == 0x01:
+            # markers without segment
+            continue
+        segment = f.read(2)
+        if len(segment) < 2:
+            return None
+        length = struct.unpack('>H', segment)[0]
+        if marker[1] in _JPEG_SOF_MARKERS:
+            header = f.read(5)
+            if len(header) < 5:
+                return None
+            height, width = struct.unpack('>HH', header[1:])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_preview(path, max_size, reuse_buffer=False, data=None):
+    """
+    Read the image downscaled so that its largest side is at most max_size, jpeg images are decoded
+    at reduced resolution (1/2, 1/4 or 1/8) by the decoder instead of decoding the full image then resizing it
+    Args:
+        path: path to the image
+        max_size: largest side in pixels of the image returned
+        reuse_buffer: decode into the buffer of the previous image
+        data: encoded bytes of the image if already read
+
+    Returns:
+        the image (None if it can not be read) and the scale (sx, sy) from the original pixels to the image pixels
+    """
+    import cv2
+
+    # a shard member is read once for its header and its decode
+    if data is None and is_member_path(path):
+        data = read_bytes(path)
+    if data is not None:
+        size = jpeg_size(io.BytesIO(data))
+    else:
+        with open(path, 'rb') as f:
+            size = jpeg_size(f)
+    flags = cv2.IMREAD_COLOR
+    if size is not None:
+        # largest reduction keeping the decoded image at least max_size, the resize then does the rest
+        for factor, reduced_flags in [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                      (2, cv2.IMREAD_REDUCED_COLOR_2)]:
+            if max(size) >= factor * max_size:
+                flags = reduced_flags
+                break
+    image = decode_image(data, flags) if data is not None else read_image(path, reuse_buffer, flags)
+    if image is None:
+        return None, None
+    height, width = image.shape[:2]
+    if size is None:
+        size = width, height
+    elif (width > height) != (size[0] > size[1]) and size[0] != size[1]:
+        # image rotated by its exif orientation
+        size = size[1], size[0]
+    if max(height, width) > max_size:
+        ratio = max_size / max(height, width)
+        image = cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))),
+                           interpolation=cv2.INTER_AREA)
+    return image, (image.shape[1] / size[0], image.shape[0] / size[1])
+
+
+def load_image(path, reuse_buffer=False, max_size=None, data=None):
+    # read the image for drawing, downscaled if max_size, return the image and the scale of the boxes (None if not)
+    # the image is decoded from data if its bytes were already read
+    if max_size:
+        return read_preview(path, max_size, reuse_buffer, data)
+    if data is not None:
+        return decode_image(data), None
+    return read_image(path, reuse_buffer), None
+
+
+def fetch_image(fn, dataset):
+    # locate and read the image fn on a prefetch thread, the bytes are read then decoded from memory
+    # return the image and the scale of the boxes, (None, None) if the image is not found
+    with stage('read'):
+        path = dataset.image_path(fn)
+        if path is None:
+            return None, None
+        return load_image(path, max_size=dataset.max_size, data=read_bytes(path))
+
+
+def output_image(image, name, output_dir, show, jpeg_quality=None):
+    # save image drawn into output_dir and/or show it on screen, jpeg images at jpeg_quality if given
+    import cv2
+
+    if output_dir:
+        output_path = os.path.join(output_dir, name)
+        params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if jpeg_quality else []
+        cv2.imwrite(output_path, image, params)
+    if show:
+        cv2.imshow('image', image)
+        cv2.waitKey(0)
+
+
+def render_batch(dataset, filenames, prefetch_depth=None):
+    """
+    Draw the annotations of the dataset onto every image of filenames
+    Args:
+        dataset: dataset with its annotations loaded (CocoDataset, OpenImagesDataset)
+        filenames: iterable of image filenames
+        prefetch_depth: if given the next prefetch_depth images are read and decoded ahead on threads
+
+    Returns:
+        iterator of (output name, image drawn as ndarray), images not found or without annotations are skipped,
+        every image is a new array kept valid after the next iteration
+    """
+    if prefetch_depth:
+        loaded_images = prefetch(lambda fn: fetch_image(fn, dataset), filenames, prefetch_depth)
+    else:
+        loaded_images = ((fn, None) for fn in filenames)
+    for fn, loaded in loaded_images:
+        image = dataset.render(fn, loaded=loaded)
+        if image is not None:
+            yield dataset.output_name(fn), image
+
+
+def render_and_output(fn, dataset, output_dir, show, jpeg_quality=None, profile_dir=None, profile_every=None,
+                      loaded=None):
+    # render one image of dataset then save and/or show it, the image buffer is reused by the next image
+    # loaded is the image and scale already read by the prefetch, return True if the image was drawn
+    with profiled(fn, profile_dir, profile_every):
+        image = dataset.render(fn, reuse_buffer=True, loaded=loaded)
+        if image is not None:
+            with stage('write'):
+                output_image(image, dataset.output_name(fn), output_dir, show, jpeg_quality)
+    return image is not None
+
+
+def render_and_output_timed(fn, **kwargs):
+    # render_and_output run by a worker, the stage durations are sent back with the result
+    collect_stages()
+    return render_and_output(fn, **kwargs), drain()
+
+
+def output_batch(dataset, filenames, output_dir, show, workers=None, jpeg_quality=None, profile_dir=None,
+                 profile_every=None, prefetch_depth=None, prefetch_threads=None):
+    """
+    Render every image of filenames then save and/or show it, used by the command line scripts
+    Args:
+        dataset: dataset with its annotations loaded
+        filenames: list of image filenames
+        output_dir: directory to save the images drawn, not saved if None
+        show: if True display every image on screen
+        workers: with workers > 1 the images are rendered and saved on a pool of processes sharing the dataset
+        jpeg_quality: quality of the jpeg images saved, PREVIEW_JPEG_QUALITY for the previews (dataset max_size)
+            and the opencv default otherwise if None
+        profile_dir: if given about one image out of profile_every is rendered under cProfile,
+            its stats are written into profile_dir
+        prefetch_depth: if given the next prefetch_depth images are read and decoded on prefetch_threads threads
+            (default prefetch_depth) while the current one is drawn and saved, ignored with workers > 1
+
+    Returns:
+        number of images drawn, the stage durations of the workers are gathered into this process
+    """
+    if output_dir and not os.path.exists(output_dir):
+        print('creating dir')
+        os.makedirs(output_dir)
+    if jpeg_quality is None and dataset.max_size:
+        jpeg_quality = PREVIEW_JPEG_QUALITY
+    # images are displayed one by one on screen, so show keeps the serial loop
+    if workers and workers > 1 and not show:
+        # forked workers would send back the durations already collected by this process
+        collected = drain()
+        results = run_parallel(render_and_output_timed, filenames, workers, dataset=dataset, output_dir=output_dir,
+                               show=False, jpeg_quality=jpeg_quality, profile_dir=profile_dir,
+                               profile_every=profile_every)
+        record(collected)
+        drawn = 0
+        for image_drawn, durations in results:
+            drawn += image_drawn
+            record(durations)
+        return drawn
+    drawn = 0
+    if prefetch_depth:
+        for fn, loaded in prefetch(lambda fn: fetch_image(fn, dataset), filenames, prefetch_depth, prefetch_threads):
+            drawn += render_and_output(fn, dataset, output_dir, show, jpeg_quality, profile_dir, profile_every,
+                                       loaded)
+        return drawn
+    for fn in filenames:
+        drawn += render_and_output(fn, dataset, output_dir, show, jpeg_quality, profile_dir, profile_every)
+    return drawn
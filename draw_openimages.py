@@ -1,27 +1,24 @@
 import os
 from argparse import ArgumentParser
-from ast import literal_eval
-import json
+import hashlib
 from pathlib import Path
-import cv2
-import pandas as pd
+import numpy as np
 import logging
-from datetime import datetime
-import sys
+import time
+from label_mapping import open_images_label_map, yolo_label_map, resolve_label
+from annotation_cache import cached_json
+from annotation_store import is_store, store_index
+from draw_core import get_filenames, draw_bboxes, output_batch, load_image
+from logging_setup import setup_logging
+from stage_timing import stage, collect_stages, run_summary, emit_summary, merge_profiles
+from shards import is_shard, shard_images, shards_stamp, restat_shards, directory_images, file_exists, read_text
+from yolo_labels import YoloLabels, _label_tokens
 
-date = datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p")
+CATEGORIES = ['cat', 'dog', 'person']
+SPLITS = ['train', 'test', 'validation']
 
-FORMAT = '%(asctime)s %(message)s'
-logging.basicConfig(format=FORMAT,
-                    filename=f"logs/logs_open_images/log_draw_{date}",
-                    filemode='a',
-                    datefmt='%H:%M:%S',
-                    level=logging.DEBUG)
-
-console = logging.StreamHandler()
-console.setLevel(logging.DEBUG)
-# add the handler to the root logger
-logging.getLogger('').addHandler(console)
+# images of the tar/zip shards of every dataset directory looked up without location index, listed once per process
+_shard_images = {}
 
 
 def draw_args():
@@ -29,31 +26,44 @@ def draw_args():
     parser.add_argument('open_images_path', help='path where all open images path are', type=str)
     parser.add_argument('open_images_prefixe', help='prefixe of open_images dataset', type=str)
     parser.add_argument('--output_dir', help='path to store output', type=str)
-    parser.add_argument('--from_open_images', help='read annotations from open_images csv file ', type=str)
+    parser.add_argument('--from_open_images', help='read annotations from open_images csv file, or from the open '
+                                                   'images rows of the parquet annotation store', type=str)
     parser.add_argument('--input_dir', help='path to images directory ', type=str)
     parser.add_argument('--from_csv', help='path to csv that contains filenames', type=str)
     parser.add_argument('--show', help='if True display image on screen', type=bool)
     parser.add_argument('--filename_list', nargs="+")
+    parser.add_argument('--yolo_names', help='path to file with one class name per line to label yolo class index',
+                        type=str)
+    parser.add_argument('--cache_dir', help='directory of the cache, the parsed open images annotations and the '
+                                            'images locations are stored there and reused while unchanged',
+                        type=str)
+    parser.add_argument('--bulk_labels', help='read every yolo labels directory at once into packed arrays, '
+                                              'default with --cache_dir', action='store_true', default=None)
+    parser.add_argument('--workers', help='number of processes drawing images in parallel', type=int, default=1)
+    parser.add_argument('--max_size', help='preview mode, the images are decoded at reduced resolution and saved '
+                                           'with their largest side at most max_size pixels', type=int)
+    parser.add_argument('--summary', help='path to write the json summary of the run (stage timings, histograms)',
+                        type=str)
+    parser.add_argument('--profile_dir', help='profile about one image out of --profile_every with cProfile, '
+                                              'the profiles are written into this directory and merged', type=str)
+    parser.add_argument('--profile_every', help='sampling of the profiled images', type=int, default=100)
+    parser.add_argument('--jpeg_quality', help='quality (0-100) of the jpeg images saved, default 85 with --max_size '
+                                               'and 95 otherwise', type=int)
+    parser.add_argument('--prefetch', help='number of images read and decoded ahead on threads while the current '
+                                           'one is drawn (ignored with --workers)', type=int)
+    parser.add_argument('--prefetch_threads', help='number of threads reading ahead, default --prefetch', type=int)
+    parser.add_argument('--path_label_ID', help='path to file that contains label ID of open images', type=str,
+                        default='class-descriptions-boxable.csv')
+    parser.add_argument('--merged_labels', help='directory of the yolo annotation set exported by '
+                                                'merge_annotations.py, read instead of the labels of every copy',
+                        type=str)
+    parser.add_argument('--store', help='parquet annotation store of annotation_store.py, the yolo labels of the '
+                                        'images to draw are read from it', type=str)
 
     args = parser.parse_args()
     return args
 
 
-def draw_bboxes(boxes, image, label):
-    " function that draw bounding boxes onto the image given and add score, category"
-    [x1, y1, x2, y2] = [int(boxes[0]), int(boxes[1]), int(boxes[2]), int(boxes[3])]
-    c1 = (x1, y1)
-    c2 = (x2, y2)
-    cv2.rectangle(image, c1, c2, (255, 0, 0), 3)
-
-    # if the text is out of image bounding , replace it
-    if y1 < 30:
-        yput_text = y1 + 15
-    else:
-        yput_text = y1 - 10
-    cv2.putText(image, label, (x1, yput_text), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (36, 255, 12), 2)
-
-
 def construct_path(open_imesges_path, prefixe, category, split):
     # construct the path of open images with the parameter category (cat, dog,person) and split (train, test, val)
     prefixe = prefixe + '_' + category
@@ -61,9 +71,74 @@ def construct_path(open_imesges_path, prefixe, category, split):
     return os.path.join(os.path.join(open_imesges_path, prefixe), suffixe)
 
 
-def check_image_in_dir(open_images_path, fn, category_list, split_list, prefixe):
+def build_location_index(open_images_path, category_list, split_list, prefixe):
+    """ list once every dataset of open-images (cat, dog, person)/(train, test, val)
+    return a dict mapping filename to the list of paths that contains it, in the order of check_image_in_dir
+    the images of the tar/zip shards of a dataset are listed from the shard member index """
+    location_index = {}
+    for category in category_list:
+        for split in split_list:
+            path = construct_path(open_images_path, prefixe, category, split)
+            if not os.path.isdir(path):
+                continue
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    if is_shard(entry.name):
+                        for name, member_path in shard_images(entry.path):
+                            location_index.setdefault(name, []).append(member_path)
+                    else:
+                        location_index.setdefault(entry.name, []).append(entry.path)
+    return location_index
+
+
+def load_location_index(open_images_path, category_list, split_list, prefixe, cache_dir=None):
+    """ get the location index, from cache_dir if given and no dataset directory changed since it was stored """
+    if not cache_dir:
+        return build_location_index(open_images_path, category_list, split_list, prefixe)
+    paths = [construct_path(open_images_path, prefixe, category, split)
+             for category in category_list for split in split_list]
+    key = '|'.join([os.path.abspath(open_images_path), prefixe] + category_list + split_list)
+    name = 'locations_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+    return cached_json(cache_dir, name, lambda previous: locations_stamp(paths, previous),
+                       lambda: build_location_index(open_images_path, category_list, split_list, prefixe))
+
+
+def locations_stamp(paths, previous=None):
+    """ [mtime, mtime of every shard] of the dataset directories, None for a missing directory.
+    A directory mtime changes when an image or a shard is added or removed into it, a shard mtime when it is
+    rewritten in place: a directory is listed only when its mtime differs from the previous stamp,
+    else only the shards of the previous stamp are stat """
+    stamp = {}
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            stamp[path] = None
+            continue
+        previous_path = (previous or {}).get(path)
+        if previous_path is not None and previous_path[0] == mtime:
+            stamp[path] = [mtime, restat_shards(path, previous_path[1])]
+        else:
+            stamp[path] = [mtime, shards_stamp(path)]
+    return stamp
+
+
+def dataset_shard_images(path):
+    # filename -> path through the shard of the images of the shards of a dataset directory, listed on first use
+    if path not in _shard_images:
+        _shard_images[path] = directory_images(path)
+    return _shard_images[path]
+
+
+def check_image_in_dir(open_images_path, fn, category_list, split_list, prefixe, location_index=None):
     """ check if the image given is present in the different dataset of open-images (cat, dog, person)/(train, test, val)
-    return a list of the different dataset taht contains the image"""
+    return a list of the different dataset taht contains the image
+    if the location index is given the lookup is done in memory without access to the file system
+    else the images of the tar/zip shards of every dataset are looked up too, listed once per process"""
+    if location_index is not None:
+        return list(location_index.get(fn, []))
     list_path = []
     for category in category_list:
         for split in split_list:
@@ -71,6 +146,10 @@ def check_image_in_dir(open_images_path, fn, category_list, split_list, prefixe)
             filename_path = os.path.join(path, fn)
             if os.path.isfile(filename_path):
                 list_path.append(filename_path)
+            # images of the tar/zip shards of the dataset
+            member_path = dataset_shard_images(path).get(fn)
+            if member_path is not None:
+                list_path.append(member_path)
     return list_path
 
 
@@ -82,130 +161,260 @@ def check_yolo_annotation(list_path, fn):
         dir_label = os.path.join(os.path.dirname(path_images), 'labels')
         filename = Path(path_images).stem
         label_path = os.path.join(dir_label, filename + '.txt')
-        if os.path.isfile(label_path):
-            # get the annotations from label path
-            with open(label_path, 'r') as f:
-                annot = [line.split(' ') for line in f.read().splitlines()]
-            f.close()
-            for line in annot:
-                list_annot.append(line)
+        # the label of an image stored into a shard is a member of the same shard
+        if file_exists(label_path):
+            # get the annotations from label path, parsed as the bulk labels: the lines without 5 values are
+            # skipped and the extra columns ignored
+            tokens = _label_tokens(read_text(label_path))
+            list_annot.extend(tokens[index:index + 5] for index in range(0, len(tokens), 5))
         else:
             logging.info(f"file {label_path} does not exists")
             continue
     return list_annot
 
 
-def get_filenames(filename_list, from_csv, input_dir):
-    # get the filenames list from the possible argument
-    if filename_list:
-        filenames = filename_list
-    elif from_csv:
-        filelist_csv = pd.read_csv(from_csv)
-        filenames = list(filelist_csv['file_name'])
-    elif input_dir:
-        filenames = [file for file in os.listdir(input_dir)]
-        # remove directory labels
-        if 'labels' in filenames:
-            filenames.remove('labels')
-    else:
-        logging.error('no input data you have to give one of this three argument (input_dir, filename_list, from_csv')
-        sys.exit()
-    if len(filenames) == 0:
-        logging.error("no image in directory")
-        sys.exit()
-    return filenames
-
-
-def draw_from_yolo(fn, all_filepaths, output_dir, show, image):
+def get_yolo_boxes(fn, all_filepaths, label_map=None, yolo_labels=None):
     """ read annotations from yolo format
-    get all annotations for this image , looking into the different dataset inside all_filepaths """
+    get all annotations for this image , looking into the different dataset inside all_filepaths
+    with yolo_labels the annotations come from the labels directories loaded at once
+    return the boxes and their labels, None if there is no annotation """
+    if yolo_labels is not None:
+        return get_bulk_yolo_boxes(fn, all_filepaths, label_map, yolo_labels)
     list_annot = check_yolo_annotation(all_filepaths, fn)
-    if len(list_annot) > 0:
-        for annot in list_annot:
-            bboxe = [float(bb) for bb in annot[1:]]
-            label = annot[0]
-            draw_bboxes(bboxe, image, label)
-        # save image drawn
-        if output_dir:
-            output_path = os.path.join(output_dir, fn)
-            cv2.imwrite(output_path, image)
-            # show image drawn
-        if show:
-            cv2.imshow('image', image)
-            cv2.waitKey(0)
-    else:
-        logging.info(f"image {fn} has no annotations in any dataset of {prefixe}")
-
-
-def check_open_annotation(annotations, fn):
-    # check in train/test/val annotations file, if filename has annotation
+    if len(list_annot) == 0:
+        logging.info(f"image {fn} has no annotations in any dataset of {all_filepaths}")
+        return None
+    bboxes = [[float(bb) for bb in annot[1:5]] for annot in list_annot]
+    labels = [resolve_label(label_map, annot[0]) for annot in list_annot]
+    return bboxes, labels
+
+
+def get_bulk_yolo_boxes(fn, all_filepaths, label_map, yolo_labels):
+    # concat the packed annotations of all the datasets that contains this filename
+    list_boxes, list_classes = [], []
+    for path_images in all_filepaths:
+        annot = yolo_labels.get(path_images)
+        if annot is None:
+            logging.info(f"file {path_images} has no label file")
+            continue
+        list_boxes.append(annot[0])
+        list_classes.append(annot[1])
+    if sum(len(classes) for classes in list_classes) == 0:
+        logging.info(f"image {fn} has no annotations in any dataset of {all_filepaths}")
+        return None
+    labels = [resolve_label(label_map, str(class_id)) for class_id in np.concatenate(list_classes)]
+    return np.concatenate(list_boxes), labels
+
+
+def get_merged_boxes(fn, merged_index, label_map=None):
+    # boxes of the image from the merged annotation set, one label file already holding the boxes of every copy
+    annot = merged_index.get(os.path.splitext(fn)[0])
+    if annot is None or len(annot[1]) == 0:
+        logging.info(f"image {fn} has no annotations in the merged annotation set")
+        return None
+    return annot[0], [resolve_label(label_map, str(class_id)) for class_id in annot[1]]
+
+
+def build_open_index(annotations):
+    """ build once the lookup ImageID -> (normalized boxes array (N, 4) as XMin YMin XMax YMax, LabelName array (N,))
+    from the open images annotations dataframe """
+    boxes = annotations[['XMin', 'YMin', 'XMax', 'YMax']].to_numpy(dtype=np.float64)
+    label_names = annotations['LabelName'].to_numpy()
+    # group the rows positions by ImageID keeping the original order of the annotations
+    groups = annotations.groupby('ImageID', sort=False).indices
+    return {image_id: (boxes[rows], label_names[rows]) for image_id, rows in groups.items()}
+
+
+def load_open_index(from_open_images):
+    # read the open images annotations csv and build the index ImageID -> annotations
+    import pandas as pd
+
+    with stage('load'):
+        open_images_annot = pd.read_csv(from_open_images, header=0,
+                                        usecols=['ImageID', 'LabelName', 'XMin', 'XMax', 'YMin', 'YMax'])
+    with stage('index'):
+        return build_open_index(open_images_annot)
+
+
+def load_store_index(store, filenames, datasets):
+    # annotation index ImageID -> (boxes, categories) of the rows of datasets in the store, only the row groups
+    # of filenames are read (all if None), the file name of an open images row is ImageID.jpg
+    file_names = None
+    if filenames is not None:
+        file_names = list(filenames) + [os.path.splitext(fn)[0] + '.jpg' for fn in filenames]
+    with stage('load'):
+        return store_index(store, 'image_id', file_names, datasets)
+
+
+def check_open_annotation(annot_index, fn):
+    # check in train/test/val annotations index, if filename has annotation
     value = True
-    if fn not in list(annotations['ImageID']):
+    if fn not in annot_index:
         logging.error(f"image: {fn} has no annotations")
         value = False
 
     return value
 
 
-def draw_from_open_images(annotation, fn, mapping_label, output_dir, show, image):
+def get_open_images_boxes(annot_index, fn, mapping_label, image_shape):
+    """ get the boxes of the image in pixels and their labels from the open images annotations index,
+    None if there is no annotation """
     # check annotations for filename
     fn = os.path.splitext(fn)[0]
-    value = check_open_annotation(annotation, fn)
-
-    if value:
-        h, w, _ = image.shape
-        # get all annotations for one filename
-        annot = annotation[annotation['ImageID'] == fn]
-        for index, row in annot.iterrows():
-            # get bboxes label and draw
-            bboxe = [float(row['XMin']) * w, float(row['YMin']) * h, float(row['XMax']) * w, float(row['YMax']) * h]
-            label = mapping_label[mapping_label['ID'] == row['LabelName']]['label'].values[0]
-            draw_bboxes(bboxe, image, label)
-        # save image drawn
-        if output_dir:
-            output_path = os.path.join(output_dir, fn + '.jpg')
-            cv2.imwrite(output_path, image)
-            # show image drawn
-        if show:
-            cv2.imshow('image', image)
-            cv2.waitKey(0)
-    else:
+    value = check_open_annotation(annot_index, fn)
+    if not value:
         logging.error(f"image: {fn} has no annotations")
+        return None
+    h, w = image_shape[:2]
+    # get all annotations for one filename and denormalize the boxes
+    boxes, label_names = annot_index[fn]
+    boxes = boxes * np.array([w, h, w, h], dtype=np.float64)
+    labels = [resolve_label(mapping_label, label_name) for label_name in label_names]
+    return boxes, labels
 
 
-def main(open_images_path, output_dir, filename_list, from_csv, input_dir, show, prefixe, from_open_images):
-    """ main functions that get filenames list,  then loop into it
-      for each image get all paths of open-images dataset tant contain it
-     finally choose whereas read from yolo or open images annotations and draw it """
-    if output_dir and not os.path.exists(output_dir):
-        print('creating dir')
-        os.makedirs(output_dir)
-    if from_open_images:
-        # load the annotations file from open images and the mapping ID to label
-        open_images_annot = pd.read_csv(from_open_images, header=0)
-        mapping_label = pd.read_csv('class-descriptions-boxable.csv', names=['ID', 'label'])
-    # get image file names
-    filenames = get_filenames(filename_list, from_csv, input_dir)
-    for fn in filenames:
-        # check if filename is in more than one dataset of open images (cat, dog, person)
-        all_filepaths = check_image_in_dir(open_images_path, fn, ['cat', 'dog', 'person'],
-                                           ['train', 'test', 'validation'], prefixe)
+class OpenImagesDataset:
+    """
+    Open images datasets (<prefixe>_<category>/raw/1/<split>/<category>) with their annotations loaded once,
+    from the open images csv if given else from the yolo labels of every dataset containing the image
+    Args:
+        open_images_path: path where all open images path are
+        prefixe: prefixe of open_images dataset
+        from_open_images: path to the open images annotations csv, yolo labels are read if None
+        path_label_ID: path to file that contains label ID of open images
+        yolo_names: path to file with one class name per line to label yolo class index
+        cache_dir: directory of the cache of the annotations, images locations and yolo labels
+        bulk_labels: if True every yolo labels directory is read at once into packed arrays,
+            default True with cache_dir
+        max_size: if given the images are rendered as previews with their largest side at most max_size pixels
+        merged_labels: directory of the yolo annotation set of merge_annotations.py, its labels are read
+            instead of the labels of every dataset containing the image
+        store: parquet annotation store of annotation_store.py, the yolo labels are read from it,
+            from_open_images can also be a store
+        filenames: with a store, only the annotations of those filenames are read (all if None)
+    """
+
+    def __init__(self, open_images_path, prefixe, from_open_images=None,
+                 path_label_ID='class-descriptions-boxable.csv', yolo_names=None, cache_dir=None, bulk_labels=None,
+                 max_size=None, merged_labels=None, store=None, filenames=None):
+
+        self.open_images_path = open_images_path
+        self.prefixe = prefixe
+        self.max_size = max_size
+        self.open_images_index, self.mapping_label = None, None
+        if from_open_images:
+            # load the annotations file from open images and the mapping ID to label
+            if is_store(from_open_images):
+                self.open_images_index = load_store_index(from_open_images, filenames, ['open_images'])
+            elif cache_dir:
+                from annotation_cache import cached_index
 
+                self.open_images_index, _ = cached_index(cache_dir, from_open_images, 'open_images',
+                                                         lambda: (load_open_index(from_open_images), None))
+            else:
+                self.open_images_index = load_open_index(from_open_images)
+            self.mapping_label = open_images_label_map(path_label_ID)
+        # mapping of yolo class index to name, raw index is drawn if not given
+        self.yolo_label = yolo_label_map(yolo_names) if yolo_names else None
+        if bulk_labels is None:
+            bulk_labels = bool(cache_dir)
+        self.yolo_labels = YoloLabels(cache_dir) if bulk_labels else None
+        # list the datasets once instead of checking every path for every image
+        with stage('index'):
+            self.location_index = load_location_index(open_images_path, CATEGORIES, SPLITS, prefixe, cache_dir)
+            self.merged_index = None
+            if merged_labels:
+                self.merged_index = YoloLabels().labels_index(os.path.join(merged_labels, 'labels'))
+            elif store:
+                # the boxes of the image in every dataset, concatenated as the labels of the copies
+                self.merged_index = load_store_index(store, filenames,
+                                                     [prefixe + '_' + category for category in CATEGORIES])
+
+    def output_name(self, fn):
+        if self.open_images_index is not None:
+            return os.path.splitext(fn)[0] + '.jpg'
+        return fn
+
+    def image_path(self, fn):
+        # path of the image read for fn, the first dataset containing it, None if it is in no dataset
+        all_filepaths = check_image_in_dir(self.open_images_path, fn, CATEGORIES, SPLITS, self.prefixe,
+                                           self.location_index)
+        return all_filepaths[0] if len(all_filepaths) > 0 else None
+
+    def render(self, fn, reuse_buffer=False, loaded=None):
+        """ look for the image fn in the open-images datasets, read it and draw the annotations
+        return None if the image is not found or has no annotations
+        with reuse_buffer the image is decoded into the buffer of the previous image rendered
+        loaded is the image and scale already read by the prefetch, (None, None) if it was not found """
+        # check if filename is in more than one dataset of open images (cat, dog, person)
+        with stage('locate'):
+            all_filepaths = check_image_in_dir(self.open_images_path, fn, CATEGORIES, SPLITS, self.prefixe,
+                                               self.location_index)
         if len(all_filepaths) == 0:
-            logging.error(f"image: {fn} is not in any directory of {prefixe}")
-            continue
+            logging.error(f"image: {fn} is not in any directory of {self.prefixe}")
+            return None
         logging.info(f"image {fn} is in those dataset {all_filepaths}")
         # get filepath to load image
         filepath = all_filepaths[0]
-        image = cv2.imread(filepath)
-        # read annotations from yolo format
-        if from_open_images:
-            draw_from_open_images(open_images_annot, fn, mapping_label, output_dir, show, image)
+        if loaded is not None:
+            image, scale = loaded
         else:
-            draw_from_yolo(fn, all_filepaths, output_dir, show, image)
+            with stage('read'):
+                image, scale = load_image(filepath, reuse_buffer, self.max_size)
+        if image is None:
+            logging.error(f"image: {filepath} can not be read")
+            return None
+        with stage('annotate'):
+            if self.open_images_index is not None:
+                # normalized boxes are denormalized to the size of the image read, preview or not
+                annot = get_open_images_boxes(self.open_images_index, fn, self.mapping_label, image.shape)
+                scale = None
+            elif self.merged_index is not None:
+                annot = get_merged_boxes(fn, self.merged_index, self.yolo_label)
+            else:
+                # read annotations from yolo format
+                annot = get_yolo_boxes(fn, all_filepaths, self.yolo_label, self.yolo_labels)
+        if annot is None:
+            return None
+        with stage('draw'):
+            draw_bboxes(image, *annot, scale)
+        return image
+
+
+def main(open_images_path, output_dir, filename_list, from_csv, input_dir, show, prefixe, from_open_images,
+         yolo_names=None, path_label_ID='class-descriptions-boxable.csv', workers=None,
+         cache_dir=None, bulk_labels=None, max_size=None, jpeg_quality=None, summary=None, profile_dir=None,
+         profile_every=100, merged_labels=None, store=None, prefetch=None, prefetch_threads=None):
+    """ main functions that get filenames list,  then loop into it
+      for each image get all paths of open-images dataset tant contain it
+     finally choose whereas read from yolo or open images annotations and draw it
+     with workers > 1 the images are drawn in parallel on a pool of processes
+     with cache_dir the open images annotations index, the images location index and the yolo labels are read
+     from the cache, built and stored the first time
+     with bulk_labels every yolo labels directory is read at once
+     with max_size the images are saved as previews downscaled at decode
+     jpeg_quality sets the quality of the images saved
+     at the end the timings of every stage are logged as json and written into summary if given,
+     with profile_dir about one image out of profile_every is profiled
+     with merged_labels the yolo annotations come from the annotation set exported by merge_annotations.py
+     with store the yolo annotations come from the parquet annotation store
+     with prefetch the next images are read and decoded on prefetch_threads threads while the current one is drawn """
+    start = time.perf_counter()
+    collect_stages()
+    # get image file names
+    filenames = get_filenames(filename_list, from_csv, input_dir)
+    dataset = OpenImagesDataset(open_images_path, prefixe, from_open_images, path_label_ID, yolo_names, cache_dir,
+                                bulk_labels, max_size, merged_labels, store, filenames)
+    drawn = output_batch(dataset, filenames, output_dir, show, workers, jpeg_quality, profile_dir, profile_every,
+                         prefetch, prefetch_threads)
+    emit_summary(run_summary(len(filenames), drawn, time.perf_counter() - start), summary)
+    merged = merge_profiles(profile_dir)
+    if merged:
+        logging.info(f"profiles of the sampled images merged into {merged}")
 
 
 if __name__ == "__main__":
+    setup_logging('logs/logs_open_images')
     args = draw_args()
     open_images_path = args.open_images_path
     output_dir = args.output_dir
@@ -215,5 +424,21 @@ if __name__ == "__main__":
     input_dir = args.input_dir
     prefixe = args.open_images_prefixe
     from_open_images = args.from_open_images
+    yolo_names = args.yolo_names
+    path_label_ID = args.path_label_ID
+    workers = args.workers
+    cache_dir = args.cache_dir
+    bulk_labels = args.bulk_labels
+    max_size = args.max_size
+    jpeg_quality = args.jpeg_quality
+    summary = args.summary
+    profile_dir = args.profile_dir
+    profile_every = args.profile_every
+    merged_labels = args.merged_labels
+    store = args.store
+    prefetch = args.prefetch
+    prefetch_threads = args.prefetch_threads
 
-    main(open_images_path, output_dir, filename_list, from_csv, input_dir, show, prefixe, from_open_images)
+    main(open_images_path, output_dir, filename_list, from_csv, input_dir, show, prefixe, from_open_images,
+         yolo_names, path_label_ID, workers, cache_dir, bulk_labels, max_size, jpeg_quality, summary, profile_dir,
+         profile_every, merged_labels, store, prefetch, prefetch_threads)
@@ -0,0 +1,53 @@
+"""
+Lookup tables category ID -> label name shared by the draw functions,
+built once per run from coco categories, open images class descriptions or a yolo names file
+"""
+import csv
+
+
+def coco_label_map(categories):
+    """
+    Build the mapping category id -> name from the coco categories block
+    Args:
+        categories: list of dict (or dataframe) with the keys id and name
+
+    Returns:
+        dict mapping category id to category name
+    """
+    if hasattr(categories, 'to_dict'):
+        categories = categories.to_dict('records')
+    return {category['id']: category['name'] for category in categories}
+
+
+def open_images_label_map(path_label_ID):
+    """
+    Build the mapping LabelName -> label from the open images class descriptions file
+    Args:
+        path_label_ID: path to file that contains label ID (class-descriptions-boxable.csv)
+
+    Returns:
+        dict mapping open images LabelName (/m/...) to label
+    """
+    with open(path_label_ID, 'r', newline='') as f:
+        return {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2}
+
+
+def yolo_label_map(path_names):
+    """
+    Build the mapping class index -> name from a yolo names file (one class name per line)
+    Args:
+        path_names: path to the names file, the line number is the class index
+
+    Returns:
+        dict mapping class index as written in the labels files ('0', '1', ...) to name
+    """
+    with open(path_names, 'r') as f:
+        names = [line.strip() for line in f.read().splitlines() if line.strip()]
+    return {str(index): name for index, name in enumerate(names)}
+
+
+def resolve_label(label_map, key):
+    # get the label name of key, fallback on the key itself when it is not in the mapping
+    if label_map is None:
+        return str(key)
+    return label_map.get(key, str(key))
@@ -0,0 +1,25 @@
+"""
+Logging configuration of the command line scripts, called under __main__ only so importing the scripts
+as modules has no side effect
+"""
+import logging
+import os
+from datetime import datetime
+
+FORMAT = '%(asctime)s %(message)s'
+
+
+def setup_logging(log_dir, prefix='log_draw_'):
+    # log into a timestamped file of log_dir (created if missing) and on the console
+    date = datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p")
+    os.makedirs(log_dir, exist_ok=True)
+    logging.basicConfig(format=FORMAT,
+                        filename=os.path.join(log_dir, f"{prefix}{date}"),
+                        filemode='a',
+                        datefmt='%H:%M:%S',
+                        level=logging.DEBUG)
+
+    console = logging.StreamHandler()
+    console.setLevel(logging.DEBUG)
+    # add the handler to the root logger
+    logging.getLogger('').addHandler(console)
@@ -0,0 +1,327 @@
+"""
+Export of the open images datasets as one deduplicated annotation set.
+The copies of an image (same filename in several datasets, or same content from the duplicate list written by
+open_image_dup.py --content_hash) are merged into one image whose boxes are the union of the boxes of every copy,
+the boxes of a same class overlapping by more than an IoU threshold being collapsed into one.
+The set is written once in coco (json) or yolo (one label file per image) format, so that the drawing and the
+training read it instead of merging the label files of the copies again for every image
+"""
+import ast
+import json
+import logging
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from draw_core import jpeg_size, read_image
+from draw_openimages import CATEGORIES, SPLITS, load_location_index, load_open_index
+from label_mapping import open_images_label_map, yolo_label_map, resolve_label
+from logging_setup import setup_logging
+from shards import open_file
+from yolo_labels import YoloLabels
+
+IOU_THRESHOLD = 0.9
+
+
+def merge_args():
+    parser = ArgumentParser()
+    parser.add_argument('open_images_path', help='path where all open images path are', type=str)
+    parser.add_argument('open_images_prefixe', help='prefixe of open_images dataset', type=str)
+    parser.add_argument('output', help='json file written with --format coco, directory with --format yolo', type=str)
+    parser.add_argument('--format', help='format of the annotation set exported', choices=['coco', 'yolo'],
+                        default='coco')
+    parser.add_argument('--duplicates', help='csv of the duplicates written by open_image_dup.py', type=str,
+                        default='duplicate_open/open_images_dup.csv')
+    parser.add_argument('--from_open_images', help='read annotations from open_images csv file instead of the yolo '
+                                                   'labels of the datasets', type=str)
+    parser.add_argument('--path_label_ID', help='path to file that contains label ID of open images', type=str,
+                        default='class-descriptions-boxable.csv')
+    parser.add_argument('--yolo_names', help='path to file with one class name per line to label yolo class index',
+                        type=str)
+    parser.add_argument('--iou', help='boxes of a same class overlapping by at least this IoU are merged', type=float,
+                        default=IOU_THRESHOLD)
+    parser.add_argument('--categories', help='categories of the open images datasets', nargs='+',
+                        default=CATEGORIES)
+    parser.add_argument('--cache_dir', help='directory of the cache of the images locations and yolo labels',
+                        type=str)
+    args = parser.parse_args()
+    return args
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    IoU of every pair of boxes, computed at once by broadcasting
+    Args:
+        boxes_a: array (N, 4) of boxes (x1, y1, x2, y2)
+        boxes_b: array (M, 4) of boxes (x1, y1, x2, y2)
+
+    Returns:
+        array (N, M) of the IoU of boxes_a[i] and boxes_b[j], 0 for empty boxes
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    area_a = np.clip(boxes_a[:, 2] - boxes_a[:, 0], 0, None) * np.clip(boxes_a[:, 3] - boxes_a[:, 1], 0, None)
+    area_b = np.clip(boxes_b[:, 2] - boxes_b[:, 0], 0, None) * np.clip(boxes_b[:, 3] - boxes_b[:, 1], 0, None)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    sides = np.clip(bottom_right - top_left, 0, None)
+    intersection = sides[..., 0] * sides[..., 1]
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def merge_boxes(boxes, labels, iou_threshold=IOU_THRESHOLD):
+    """
+    Collapse the boxes of a same label that overlap, NMS without score: the boxes are visited in order and a box
+    is dropped when it overlaps a box kept before it with the same label by at least iou_threshold
+    (or is equal to it). The IoU of all the pairs is computed once, every box kept then drops its overlaps
+    in one array operation
+    Args:
+        boxes: array (N, 4) of boxes (x1, y1, x2, y2)
+        labels: array (N,) of the labels of the boxes
+        iou_threshold: minimum IoU of two boxes of a same label to merge them
+
+    Returns:
+        indices of the boxes kept, in their original order
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, label_codes = np.unique(np.asarray(labels), return_inverse=True)
+    label_codes = label_codes.reshape(-1)
+    overlaps = (box_iou(boxes, boxes) >= iou_threshold) | np.all(boxes[:, None] == boxes[None, :], axis=-1)
+    overlaps &= label_codes[:, None] == label_codes[None, :]
+    dropped = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for index in range(len(boxes)):
+        if dropped[index]:
+            continue
+        keep.append(index)
+        dropped |= overlaps[index]
+    return np.array(keep, dtype=np.int64)
+
+
+def read_duplicate_groups(duplicates):
+    """ list of the paths of every row of the duplicates csv of open_image_dup.py, the path cells are python lists
+    written as text, an empty list if the file does not exist """
+    import pandas as pd
+
+    if not duplicates or not os.path.isfile(duplicates):
+        logging.info(f"no duplicate list {duplicates}, only the copies with the same filename are merged")
+        return []
+    df_dup = pd.read_csv(duplicates)
+    return [list(ast.literal_eval(paths)) for paths in df_dup['path']]
+
+
+def image_groups(location_index, duplicate_groups):
+    """
+    Group the copies of every image: the paths of a same filename from the location index and the paths of a row
+    of the duplicate list, groups sharing a path are joined
+    Args:
+        location_index: dict mapping filename to the list of paths that contains it
+        duplicate_groups: list of list of paths of the duplicates csv
+
+    Returns:
+        list of (filename, paths) with the filename of the first path, in the order of the location index
+    """
+    parents = {}
+
+    def find(path):
+        # root of the group of path, the paths visited are attached to it
+        root = path
+        while parents[root] != root:
+            root = parents[root]
+        while parents[path] != root:
+            parents[path], path = root, parents[path]
+        return root
+
+    groups = list(location_index.values()) + duplicate_groups
+    for paths in groups:
+        paths = [os.path.normpath(path) for path in paths]
+        for path in paths:
+            parents.setdefault(path, path)
+        for path in paths[1:]:
+            parents[find(path)] = find(paths[0])
+    members = {}
+    for path in parents:
+        members.setdefault(find(path), []).append(path)
+    return [(os.path.basename(paths[0]), paths) for paths in members.values()]
+
+
+def image_size(path):
+    # width and height of the image from its jpeg header, the image is decoded for the other formats
+    with open_file(path) as f:
+        size = jpeg_size(f)
+    if size is None:
+        image = read_image(path)
+        if image is None:
+            return None
+        size = image.shape[1], image.shape[0]
+    return size
+
+
+def merge_image(paths, annotations_of, size, iou_threshold=IOU_THRESHOLD):
+    """
+    Boxes of one image merged from all its copies
+    Args:
+        paths: paths of the copies of the image
+        annotations_of: function returning the boxes in pixels and labels of a copy (None if it has none)
+            from its path and the image size
+        size: width and height of the image, None if annotations_of does not need it
+        iou_threshold: minimum IoU of two boxes of a same label to merge them
+
+    Returns:
+        boxes array (N, 4), labels array (N,) and the number of boxes of the copies before the merge
+    """
+    list_boxes, list_labels = [], []
+    for path in paths:
+        annot = annotations_of(path, size)
+        if annot is not None:
+            list_boxes.append(annot[0])
+            list_labels.append(annot[1])
+    if len(list_boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), 0
+    boxes = np.concatenate(list_boxes).reshape(-1, 4)
+    labels = np.concatenate(list_labels)
+    keep = merge_boxes(boxes, labels, iou_threshold)
+    return boxes[keep], labels[keep], len(boxes)
+
+
+def export_coco(records, label_names, output):
+    """
+    Write the annotation set as a coco json
+    Args:
+        records: list of dict with file_name, path, width, height, boxes (N, 4) in pixels and classes (N,)
+        label_names: list of the class names, the class is the category id
+        output: path of the json file
+    """
+    images, annotations = [], []
+    for image_id, record in enumerate(records, 1):
+        images.append({'id': image_id, 'file_name': record['file_name'], 'path': record['path'],
+                       'width': record['width'], 'height': record['height']})
+        for (x1, y1, x2, y2), class_id in zip(record['boxes'].tolist(), record['classes'].tolist()):
+            annotations.append({'id': len(annotations) + 1, 'image_id': image_id, 'category_id': class_id,
+                                'bbox': [x1, y1, x2 - x1, y2 - y1], 'area': (x2 - x1) * (y2 - y1), 'iscrowd': 0})
+    categories = [{'id': class_id, 'name': name} for class_id, name in enumerate(label_names)]
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'images': images, 'annotations': annotations, 'categories': categories}, f)
+
+
+def export_yolo(records, label_names, output):
+    """
+    Write the annotation set as yolo labels: output/labels/<stem>.txt with one line "class x1 y1 x2 y2" (pixels)
+    per box, written under the filename of every copy so a renamed copy finds the boxes of its image,
+    output/images.txt with the path of the image read for every image
+    and output/classes.txt with one class name per line (usable as --yolo_names)
+    Args:
+        records: list of dict with file_name, file_names of the copies, path, boxes (N, 4) in pixels
+            and classes (N,)
+        label_names: list of the class names, the line number is the class
+        output: directory of the yolo annotation set
+    """
+    labels_dir = os.path.join(output, 'labels')
+    os.makedirs(labels_dir, exist_ok=True)
+    for record in records:
+        lines = [' '.join([str(class_id)] + [repr(value) for value in box])
+                 for box, class_id in zip(record['boxes'].tolist(), record['classes'].tolist())]
+        stems = dict.fromkeys(os.path.splitext(name)[0] for name in record['file_names'])
+        for stem in stems:
+            with open(os.path.join(labels_dir, stem + '.txt'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+    with open(os.path.join(output, 'images.txt'), 'w') as f:
+        f.write(''.join(record['path'] + '\n' for record in records))
+    with open(os.path.join(output, 'classes.txt'), 'w') as f:
+        f.write(''.join(name + '\n' for name in label_names))
+
+
+def main(open_images_path, prefixe, output, output_format='coco', duplicates='duplicate_open/open_images_dup.csv',
+         from_open_images=None, path_label_ID='class-descriptions-boxable.csv', yolo_names=None,
+         iou_threshold=IOU_THRESHOLD, categories=CATEGORIES, cache_dir=None):
+    """
+    Merge the copies of every image of the open images datasets and export the annotation set once
+    Args:
+        open_images_path: path where all open images path are
+        prefixe: prefixe of open_images dataset
+        output: json file (coco) or directory (yolo) written
+        output_format: coco or yolo
+        duplicates: csv of the duplicates of open_image_dup.py, the copies with another filename are merged too
+        from_open_images: open images annotations csv, the yolo labels of the datasets are read if None
+        path_label_ID: path to file that contains label ID of open images
+        yolo_names: path to file with one class name per line to label yolo class index
+        iou_threshold: minimum IoU of two boxes of a same class to merge them
+        categories: categories of the open images datasets
+        cache_dir: directory of the cache of the images locations and yolo labels
+
+    Returns:
+        number of images exported
+    """
+    location_index = load_location_index(open_images_path, list(categories), SPLITS, prefixe, cache_dir)
+    groups = image_groups(location_index, read_duplicate_groups(duplicates))
+    logging.info(f"{len(groups)} images from {sum(len(paths) for _, paths in groups)} copies")
+    if from_open_images:
+        open_images_index = load_open_index(from_open_images)
+
+        def annotations_of(path, size):
+            # normalized boxes of the ImageID denormalized to the image size
+            annot = open_images_index.get(os.path.splitext(os.path.basename(path))[0])
+            if annot is None:
+                return None
+            width, height = size
+            return annot[0] * np.array([width, height, width, height], dtype=np.float64), annot[1]
+    else:
+        yolo_labels = YoloLabels(cache_dir)
+
+        def annotations_of(path, size):
+            return yolo_labels.get(path)
+
+    # the size of the images is only needed by the coco images and to denormalize the open images boxes,
+    # the yolo labels are already in pixels
+    need_size = output_format != 'yolo' or bool(from_open_images)
+    records = []
+    boxes_before, boxes_after = 0, 0
+    for filename, paths in groups:
+        size = image_size(paths[0]) if need_size else None
+        if need_size and size is None:
+            logging.error(f"image {paths[0]} can not be read")
+            continue
+        boxes, labels, count = merge_image(paths, annotations_of, size, iou_threshold)
+        if len(boxes) == 0:
+            logging.info(f"image {filename} has no annotations in any dataset of {paths}")
+            continue
+        boxes_before += count
+        boxes_after += len(boxes)
+        file_names = list(dict.fromkeys(os.path.basename(path) for path in paths))
+        records.append({'file_name': filename, 'file_names': file_names, 'path': paths[0],
+                        'width': size[0] if size else None, 'height': size[1] if size else None,
+                        'boxes': boxes, 'labels': labels})
+    # classes of the set: the yolo class index, or the position of the open images LabelName
+    if from_open_images:
+        label_map = open_images_label_map(path_label_ID)
+        label_keys = sorted({label for record in records for label in record['labels'].tolist()})
+        class_of = {label: class_id for class_id, label in enumerate(label_keys)}
+        for record in records:
+            record['classes'] = np.array([class_of[label] for label in record['labels'].tolist()], dtype=np.int64)
+        label_names = [resolve_label(label_map, label) for label in label_keys]
+    else:
+        label_map = yolo_label_map(yolo_names) if yolo_names else None
+        for record in records:
+            record['classes'] = record['labels'].astype(np.int64)
+        max_class = max((int(record['classes'].max()) for record in records), default=-1)
+        label_names = [resolve_label(label_map, str(class_id)) for class_id in range(max_class + 1)]
+    if output_format == 'yolo':
+        export_yolo(records, label_names, output)
+    else:
+        export_coco(records, label_names, output)
+    logging.info(f"{len(records)} images exported into {output}, {boxes_before} boxes merged into {boxes_after}")
+    return len(records)
+
+
+if __name__ == '__main__':
+    setup_logging('logs/logs_merge', 'log_merge_')
+    args = merge_args()
+    main(args.open_images_path, args.open_images_prefixe, args.output, args.format, args.duplicates,
+         args.from_open_images, args.path_label_ID, args.yolo_names, args.iou, args.categories, args.cache_dir)
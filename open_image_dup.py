@@ -1,12 +1,16 @@
 import logging
 import os
-import pandas as pd
 import json
 import time
 import collections
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from datetime import datetime
+from logging_setup import setup_logging
+from content_dup import (list_dataset_files, find_content_duplicates, build_content_dataframe, load_hash_cache,
+                         save_hash_cache, CSV_COLUMNS)
+from scan_manifest import load_manifest, save_manifest, scan_directory
+from shards import is_shard, shard_images, directory_images
 
 """
 Para el dataset OpenImages: utilidad que devuelva las imágenes de OpenImages que se encuentran en más de una carpeta
@@ -17,20 +21,6 @@ Input: path donde encontrar todos los datasets de OpenImages y el prefijo de los
  use set.intersection(set(os.lisdir(cat,dog) ))with filename
 Salida: CSV con 4 columnas: filename, path, categoría numérica de OpenImages y label alfanumérica (person, cat, dog)"""
 
-date = datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p")
-
-FORMAT = '%(asctime)s %(message)s'
-logging.basicConfig(format=FORMAT,
-                    filename=f"logs/logs_dup/log_{date}",
-                    filemode='a',
-                    datefmt='%H:%M:%S',
-                    level=logging.DEBUG)
-
-console = logging.StreamHandler()
-console.setLevel(logging.DEBUG)
-# add the handler to the root logger
-logging.getLogger('').addHandler(console)
-
 
 def function_args():
     parser = ArgumentParser()
@@ -38,100 +28,251 @@ def function_args():
     parser.add_argument('open_images_prefixe', help='prefixe of open_images dataset', type=str)
     parser.add_argument('open_images_sufixe', help='sufixe of open_images dataset ', type=str)
     parser.add_argument('path_label_ID', help='path to file that contains label ID ', type=str)
+    parser.add_argument('--content_hash', help='also find the images with the same content whatever their filename, '
+                                               'a match_type column is added to the csv', action='store_true')
+    parser.add_argument('--perceptual', help='with --content_hash also group near duplicates by perceptual hash',
+                        action='store_true')
+    parser.add_argument('--hash_cache', help='json file storing the fingerprints between runs', type=str)
+    parser.add_argument('--workers', help='number of threads hashing the files', type=int, default=8)
+    parser.add_argument('--scan_workers', help='maximum number of directories listed concurrently', type=int,
+                        default=9)
+    parser.add_argument('--manifest', help='json file storing what was scanned, next runs only scan the directories '
+                                           'and files modified since', type=str)
+    parser.add_argument('--full_rescan', help='with --manifest ignore the stored scan and scan everything',
+                        action='store_true')
+    parser.add_argument('--categories', help='categories of the open images datasets', nargs='+',
+                        default=['cat', 'dog', 'person'])
+    parser.add_argument('--store', help='parquet annotation store of annotation_store.py, the images of every dataset '
+                                        'are read from it instead of listing the directories', type=str)
     args = parser.parse_args()
     return args
 
 
-def get_path(split, path_oi, prefixe, suffixe):
+def get_path(split, path_oi, prefixe, suffixe, categories=('cat', 'dog', 'person')):
     """
-    Get all paths of split (train, test, val) for all open-images dataset (cat,person,dog)
+    Get all paths of split (train, test, val) for all open-images dataset (cat,person,dog ...)
     Args:
         split: the split to look into (train,test,val)
         path_oi: path to the directory containing all open images dataset
         prefixe: prefixe of open images dataset
         suffixe: suffixe of open images dataset
+        categories: categories of the open images datasets
 
     Returns:
-        path to all open-images dataset (cat/person/dog) for one split
+        dict mapping every category to the path of its open-images dataset for one split, in the order of categories
     """
-    path_cat = os.path.join(os.path.join(path_oi, prefixe + '_cat'), suffixe)
-    path_dog = os.path.join(os.path.join(path_oi, prefixe + '_dog'), suffixe)
-    path_person = os.path.join(os.path.join(path_oi, prefixe + '_person'), suffixe)
+    paths = {}
+    for category in categories:
+        path_category = os.path.join(os.path.join(path_oi, prefixe + '_' + category), suffixe)
+        paths[category] = os.path.join(os.path.join(path_category, split), category)
+    return paths
+
 
-    path_cat = os.path.join(os.path.join(path_cat, split), 'cat')
-    path_dog = os.path.join(os.path.join(path_dog, split), 'dog')
-    path_person = os.path.join(os.path.join(path_person, split), 'person')
-    return path_dog, path_person, path_cat
+def list_files(path):
+    # list the images of a dataset, skipping the directory labels, the images of its tar/zip shards included
+    # return the filenames and the dict filename -> path through the shard of the images that are only into a shard
+    if not os.path.isdir(path):
+        logging.info(f"directory {path} does not exist")
+        return [], {}
+    filenames = []
+    shard_paths = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if is_shard(entry.name):
+                shard_paths.append(entry.path)
+            else:
+                filenames.append(entry.name)
+    # an image is listed once per dataset, even if it is both loose and into a shard or into several shards,
+    # a loose image or the image of a previous shard in name order keeps its place
+    loose = set(filenames)
+    members = {}
+    for shard_path in sorted(shard_paths):
+        for name, member_path in shard_images(shard_path):
+            if name not in loose:
+                members.setdefault(name, member_path)
+    return filenames + list(members), members
 
 
-def get_intersection(path_cat, path_dog, path_person):
+def build_inverted_index(paths, executor=None, members=None):
+    """
+    List every dataset once and build the inverted index filename -> categories containing it
+    Args:
+        paths: dict mapping category to the path of its open-images dataset
+        executor: if given the datasets are listed concurrently on this thread pool
+        members: if given, filled with category -> dict filename -> path through the shard of its shard images
+
+    Returns:
+        dict mapping every filename to the list of its categories, in the order of paths
+    """
+    if executor is not None:
+        listings = executor.map(list_files, paths.values())
+    else:
+        listings = map(list_files, paths.values())
+    inverted_index = {}
+    # merge the listings in the order of paths whatever the order they finished
+    for category, (filenames, category_members) in zip(paths, listings):
+        if members is not None:
+            members[category] = category_members
+        for filename in filenames:
+            inverted_index.setdefault(filename, []).append(category)
+    return inverted_index
+
+
+def get_intersection(paths, executor=None, members=None):
     """
     get all filenames that are in more than one dataset
     Args:
-        path_cat: path to open-images-cat images
-        path_dog: path to open-images-dog images
-        path_person: path to open-images-person images
-
-    Returns: all intersection combination as list that contains images that are in more than one dataset
-    """
-    # list filenames in all dataset and convert it into a set
-    set_cat = set(os.listdir(path_cat))
-    set_person = set(os.listdir(path_person))
-    set_dog = set(os.listdir(path_dog))
-    # get intersection between the different set
-    inter_dog_cat = set_dog.intersection(set_cat)
-    inter_dog_person = set_dog.intersection(set_person)
-    inter_cat_person = set_cat.intersection(set_person)
-    inter_dog_cat_person = inter_dog_cat.intersection(set_person)
-    list_intersection = [inter_dog_cat, inter_dog_person, inter_cat_person, inter_dog_cat_person]
-    # remove directory "labels" in every set
-    for inter in list_intersection:
-        if 'labels' in inter:
-            inter.remove('labels')
-    # remove images that are in more than 2 dataset
-    # explain : filename that are in inter_dog_cat_person are also in dog_cat , dog_person, cat_person, remove to avoid duplicate
-    inter_dog_cat = inter_dog_cat - inter_dog_cat_person
-    inter_dog_person = inter_dog_person - inter_dog_cat_person
-    inter_cat_person = inter_cat_person - inter_dog_cat_person
-
-    return [list(inter_dog_cat), list(inter_dog_person), list(inter_cat_person), list(inter_dog_cat_person)]
-
-
-def path_column(row, path_dog, path_cat, path_person):
-    # build the column path
-    if row['label'] == ['cat', 'person']:
-        return [os.path.join(path_cat, row['filename']), os.path.join(path_person, row['filename'])]
-    elif row['label'] == ['person', 'dog']:
-        return [os.path.join(path_dog, row['filename']), os.path.join(path_person, row['filename'])]
-    elif row['label'] == ['cat', 'dog']:
-        return [os.path.join(path_cat, row['filename']), os.path.join(path_dog, row['filename'])]
-    elif row['label'] == ['cat', 'dog', 'person']:
-        return [os.path.join(path_cat, row['filename']), os.path.join(path_dog, row['filename']),
-                os.path.join(path_person, row['filename'])]
-
-
-def label_id_column(row, label_id):
-    # build the column ID_label
-    if row['label'] == ['cat', 'person']:
-        return [label_id[0], label_id[2]]
-    elif row['label'] == ['person', 'dog']:
-        return [label_id[1], label_id[2]]
-    elif row['label'] == ['cat', 'dog']:
-        return [label_id[0], label_id[1]]
-    elif row['label'] == ['cat', 'dog', 'person']:
-        return label_id
-
-
-def build_dataframe(df, intersection, path_dog, path_cat, path_person, label_list, label_id):
-    # build the dataframe of duplicate
-    df['filename'] = pd.Series(intersection)
-    df['label'] = pd.Series([label_list] * len(intersection))
-    df['path'] = df.apply(lambda row: path_column(row, path_dog, path_cat, path_person), axis=1)
-    df['ID_label'] = df.apply(lambda row: label_id_column(row, label_id), axis=1)
-    return df
-
-
-def main(split, path_oi, prefixe, suffixe, label_id):
+        paths: dict mapping category to the path of its open-images dataset
+        executor: if given the datasets are listed concurrently on this thread pool
+        members: if given, filled with category -> dict filename -> path through the shard of its shard images
+
+    Returns: dict mapping every filename that is in more than one dataset to the list of its categories
+    """
+    inverted_index = build_inverted_index(paths, executor, members)
+    return {filename: categories for filename, categories in inverted_index.items() if len(categories) > 1}
+
+
+def get_intersection_store(split, prefixe, categories, store):
+    """
+    get all filenames that are in more than one dataset from the annotation store, only the file_name and dataset
+    columns of the rows of the split are read
+    Args:
+        split: the split to look into (train,test,val)
+        prefixe: prefixe of open images dataset
+        categories: categories of the open images datasets
+        store: path of the parquet annotation store
+
+    Returns: dict mapping every filename that is in more than one dataset to the list of its categories
+    """
+    from annotation_store import read_store
+
+    datasets = {prefixe + '_' + category: category for category in categories}
+    rows = read_store(store, datasets=datasets, split=split, columns=['file_name', 'dataset']).drop_duplicates()
+    inverted_index = {}
+    # in the order of categories whatever the order of the rows
+    for dataset in datasets:
+        for filename in rows['file_name'][rows['dataset'] == dataset]:
+            inverted_index.setdefault(filename, []).append(datasets[dataset])
+    return {filename: categories for filename, categories in inverted_index.items() if len(categories) > 1}
+
+
+def get_intersection_incremental(split, paths, manifest, executor=None, members=None):
+    """
+    get all filenames that are in more than one dataset, listing only the datasets modified since the previous run
+    and checking again only the filenames added or removed
+    Args:
+        split: the split to look into (train,test,val)
+        paths: dict mapping category to the path of its open-images dataset
+        manifest: scan manifest of the previous runs, updated with this scan
+        executor: if given the datasets are listed concurrently on this thread pool
+        members: if given, filled with category -> dict filename -> path through the shard of its shard images
+
+    Returns: dict mapping every filename that is in more than one dataset to the list of its categories
+    """
+    if executor is not None:
+        scans = executor.map(lambda path: scan_directory(path, manifest), paths.values())
+    else:
+        scans = (scan_directory(path, manifest) for path in paths.values())
+    files = {}
+    changed = set()
+    for category, (category_files, changed_files) in zip(paths, scans):
+        files[category] = category_files
+        changed.update(changed_files)
+        if members is not None:
+            members[category] = manifest['dirs'].get(paths[category], {}).get('members', {})
+    duplicates = manifest['duplicates'].get(split)
+    if duplicates is None:
+        # first scan of the split, check every filename
+        duplicates = {}
+        changed = set().union(*files.values())
+    # merge the delta into the duplicates of the previous runs
+    for filename in changed:
+        categories = [category for category in paths if filename in files[category]]
+        if len(categories) > 1:
+            duplicates[filename] = categories
+        else:
+            duplicates.pop(filename, None)
+    manifest['duplicates'][split] = duplicates
+    logging.info(f"split {split}: {len(changed)} filenames added or removed since the previous scan")
+    return duplicates
+
+
+def build_dataframe(intersection, paths, label_id, members=None):
+    """
+    build the dataframe of duplicate column by column: the filenames are coded by their combination of categories
+    and the path, label and ID_label of every combination are built once then broadcast to its filenames
+    Args:
+        intersection: dict mapping filename to the list of its categories
+        paths: dict mapping category to the path of its open-images dataset
+        label_id: dict mapping category to the ID of the label
+        members: dict mapping category to the dict filename -> path through the shard of the images that are only
+            into a shard, from the listing of the intersection, the shards are listed if None
+
+    Returns: dataframe with the columns filename, path, label and ID_label sorted by filename
+    """
+    import numpy as np
+    import pandas as pd
+
+    filenames = np.array(sorted(intersection), dtype=object)
+    # code of the combination of categories of every filename
+    combinations = {}
+    codes = np.fromiter((combinations.setdefault(tuple(intersection[filename]), len(combinations))
+                         for filename in filenames), dtype=np.int64, count=len(filenames))
+    # path prefix of every category, the path is prefix + filename for the loose images
+    prefixes = {category: os.path.join(path, '') for category, path in paths.items()}
+    # and the path through the shard for the images stored into a tar/zip shard
+    if members is None:
+        members = {category: directory_images(path) for category, path in paths.items()}
+    path_column = np.empty(len(filenames), dtype=object)
+    label_column = np.empty(len(filenames), dtype=object)
+    id_column = np.empty(len(filenames), dtype=object)
+    for combination, code in combinations.items():
+        rows = np.flatnonzero(codes == code)
+        names = filenames[rows]
+        ids = [label_id.get(category) for category in combination]
+        category_paths = [category_paths_of(names, prefixes[category], members.get(category, {}))
+                          for category in combination]
+        # lists wrapped into a series so numpy keeps them as cells instead of a 2d array
+        path_column[rows] = pd.Series(list(map(list, zip(*category_paths))), dtype=object).to_numpy()
+        label_column[rows] = pd.Series([list(combination) for _ in range(len(rows))], dtype=object).to_numpy()
+        id_column[rows] = pd.Series([list(ids) for _ in range(len(rows))], dtype=object).to_numpy()
+    return pd.DataFrame({'filename': filenames, 'path': path_column, 'label': label_column, 'ID_label': id_column},
+                        columns=['filename', 'path', 'label', 'ID_label'])
+
+
+def category_paths_of(names, prefix, members):
+    # paths of the filenames in one dataset, the path through the shard for an image only into a shard
+    # else prefix + filename
+    import numpy as np
+
+    if len(members) == 0:
+        return prefix + names
+    return np.array([members.get(name, prefix + name) for name in names], dtype=object)
+
+
+def get_label_id(df_label_id, categories):
+    """
+    Get the open images ID of every category
+    Args:
+        df_label_id: dataframe that contains mapping ID to label
+        categories: categories of the open images datasets (cat, dog, person ...)
+
+    Returns:
+        dict mapping category to its ID, the label is matched without case and with _ as space
+    """
+    id_by_label = {label.lower(): label_id for label_id, label in zip(df_label_id['ID'], df_label_id['label'])}
+    label_id = {}
+    for category in categories:
+        label_id[category] = id_by_label.get(category.replace('_', ' ').lower())
+        if label_id[category] is None:
+            logging.info(f"category {category} has no ID in label file")
+    return label_id
+
+
+def main(split, path_oi, prefixe, suffixe, label_id, categories=('cat', 'dog', 'person'), manifest=None,
+         executor=None, store=None):
     """
     Construct the dataframe that will have all images that are in more than one dataset
     Args:
@@ -139,61 +280,59 @@ def main(split, path_oi, prefixe, suffixe, label_id):
         path_oi: path to the directory containing all open images dataset
         prefixe: prefixe of open images dataset
         suffixe: suffixe of open images dataset
-        label_id: the ID of the label
+        label_id: dict mapping category to the ID of the label
+        categories: categories of the open images datasets
+        manifest: scan manifest of the previous runs, if given only the modified datasets are listed again
+        executor: if given the datasets are listed concurrently on this thread pool
+        store: parquet annotation store, if given the images of every dataset are read from it
 
     Returns:
         return a dataframe with all the duplicate or none if no duplicate were found
     """
     # get the path of all dataset of the split given as input
-    path_dog, path_person, path_cat = get_path(split, path_oi, prefixe, suffixe)
-    # get all combination of intersection between the differents set of images
-    inter_dog_cat, inter_dog_person, inter_cat_person, inter_dog_cat_person = get_intersection(path_cat, path_dog,
-                                                                                               path_person)
-    list_df = []
-    # build dataframe for all combination of intersection
-    if len(inter_dog_cat) > 0:
-        df_dog_cat = pd.DataFrame(columns=['filename', 'path', 'label', 'ID_label'])
-        list_df.append(
-            build_dataframe(df_dog_cat, inter_dog_cat, path_dog, path_cat, path_person, ['cat', 'dog'], label_id))
-    if len(inter_dog_person) > 0:
-        df_dog_person = pd.DataFrame(columns=['filename', 'path', 'label', 'ID_label'])
-        list_df.append(
-            build_dataframe(df_dog_person, inter_dog_person, path_dog, path_cat, path_person, ['person', 'dog'],
-                            label_id))
-    if len(inter_cat_person) > 0:
-        df_cat_person = pd.DataFrame(columns=['filename', 'path', 'label', 'ID_label'])
-        list_df.append(
-            build_dataframe(df_cat_person, inter_cat_person, path_dog, path_cat, path_person, ['cat', 'person'],
-                            label_id))
-    if len(inter_dog_cat_person) > 0:
-        df_dog_cat_person = pd.DataFrame(columns=['filename', 'path', 'label', 'ID_label'])
-        list_df.append(
-            build_dataframe(df_dog_cat_person, inter_dog_cat_person, path_dog, path_cat, path_person,
-                            ['cat', 'dog', 'person'], label_id))
-    # concat all combination into one dataframe
-    if len(list_df) > 0:
-        result = pd.concat(list_df, ignore_index=True)
-        return result, True
+    paths = get_path(split, path_oi, prefixe, suffixe, categories)
+    # get the categories of every filename that is in more than one dataset
+    # with the paths through the shards of the images listed, the store does not list them
+    members = None
+    if store:
+        intersection = get_intersection_store(split, prefixe, categories, store)
+    elif manifest is None:
+        members = {}
+        intersection = get_intersection(paths, executor, members)
+    else:
+        members = {}
+        intersection = get_intersection_incremental(split, paths, manifest, executor, members)
+    if len(intersection) > 0:
+        return build_dataframe(intersection, paths, label_id, members), True
     else:
         return None, False
 
 
 if __name__ == '__main__':
+    import pandas as pd
+
+    setup_logging('logs/logs_dup', 'log_')
     args = function_args()
     path_oi = args.open_images_path
     prefixe = args.open_images_prefixe
     suffixe = args.open_images_sufixe
     # load dataframe that contains mapping ID to label
     df_label_id = pd.read_csv(args.path_label_ID, names=['ID', 'label'])
-    # get category ID of dog person and cat label
-    cat_id = df_label_id[df_label_id['label'] == 'Cat']['ID'].values[0]
-    dog_id = df_label_id[df_label_id['label'] == 'Dog']['ID'].values[0]
-    person_id = df_label_id[df_label_id['label'] == 'Person']['ID'].values[0]
-    cat_dog_person_id = [cat_id, dog_id, person_id]
+    categories = args.categories
+    # get category ID of every category label
+    label_id = get_label_id(df_label_id, categories)
+    manifest = load_manifest(args.manifest, categories, args.full_rescan) if args.manifest else None
     # for each split ( train,test,val) get a dataframe of all images having more than one category
-    res_train, train_bool = main('train', path_oi, prefixe, suffixe, cat_dog_person_id)
-    res_test, test_bool = main('test', path_oi, prefixe, suffixe, cat_dog_person_id)
-    res_val, val_bool = main('validation', path_oi, prefixe, suffixe, cat_dog_person_id)
+    # the splits run at the same time and share a pool listing at most scan_workers directories concurrently
+    splits = ['train', 'test', 'validation']
+    with ThreadPoolExecutor(max_workers=args.scan_workers) as listing_executor, \
+            ThreadPoolExecutor(max_workers=len(splits)) as split_executor:
+        futures = {split: split_executor.submit(main, split, path_oi, prefixe, suffixe, label_id, categories, manifest,
+                                                listing_executor, args.store)
+                   for split in splits}
+        res_train, train_bool = futures['train'].result()
+        res_test, test_bool = futures['test'].result()
+        res_val, val_bool = futures['validation'].result()
     list_results = []
     if val_bool:
         list_results.append(res_val)
@@ -201,9 +340,26 @@ if __name__ == '__main__':
         list_results.append(res_train)
     if test_bool:
         list_results.append(res_test)
+    header = ['filename', 'path', 'label', 'ID_label']
+    if args.content_hash:
+        # fingerprint the images of all splits and categories to find the copies whatever their filename
+        for res in list_results:
+            res['match_type'] = 'filename'
+        paths_by_split = {split: get_path(split, path_oi, prefixe, suffixe, categories)
+                          for split in ['validation', 'train', 'test']}
+        # the fingerprints are kept into the manifest if given, else into the hash cache file
+        fingerprints = manifest['fingerprints'] if manifest is not None else load_hash_cache(args.hash_cache)
+        groups = find_content_duplicates(list_dataset_files(paths_by_split, manifest), args.workers, fingerprints,
+                                         args.perceptual)
+        if manifest is None and args.hash_cache:
+            save_hash_cache(args.hash_cache, fingerprints)
+        if len(groups) > 0:
+            list_results.append(build_content_dataframe(groups, label_id))
+        header = CSV_COLUMNS
+    if manifest is not None:
+        save_manifest(args.manifest, manifest)
     if len(list_results) > 0:
         result = pd.concat(list_results, ignore_index=True)
-        result.to_csv('duplicate_open/open_images_dup.csv', header=['filename', 'path', 'label', 'ID_label'],
-                      index=False)
+        result.to_csv('duplicate_open/open_images_dup.csv', header=header, index=False)
     else:
         logging.info('final dataframe empty no duplicate found')
@@ -0,0 +1,47 @@
+"""
+Run the per image work (read, draw, write) of the draw functions on a pool of processes.
+The annotations are given once to every worker at its start instead of being sent with every image
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# per image function and its arguments shared by all the images, set once in every worker
+_worker_context = {}
+
+
+def _init_worker(func, kwargs):
+    _worker_context['func'] = func
+    _worker_context['kwargs'] = kwargs
+
+
+def _run_one(item):
+    return _worker_context['func'](item, **_worker_context['kwargs'])
+
+
+def run_parallel(func, items, workers, max_in_flight=None, **kwargs):
+    """
+    Call func(item, **kwargs) for every item on a pool of processes
+    Args:
+        func: module level function doing the work for one item
+        items: iterable of items (filenames)
+        workers: number of processes
+        max_in_flight: maximum number of items submitted and not finished, default 2 * workers,
+            bound the memory used by the pending images
+        **kwargs: arguments shared by all items (annotations index, label mapping ...)
+
+    Returns:
+        list of the results of func in the order of items
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    results = {}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(func, kwargs)) as executor:
+        for position, item in enumerate(items):
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+            pending[executor.submit(_run_one, item)] = position
+        for future in wait(pending).done:
+            results[pending[future]] = future.result()
+    return [results[position] for position in sorted(results)]
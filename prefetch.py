@@ -0,0 +1,35 @@
+"""
+Read ahead of the images of the draw functions on a pool of threads.
+The bytes of the next images are fetched and decoded while the current image is drawn and saved, so the draw loop
+does not wait for the file system. At most depth images are pending, which bounds the memory of the decoded images
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from stage_timing import stage
+
+
+def prefetch(func, items, depth, threads=None):
+    """
+    Call func(item) ahead on a pool of threads and yield the results in the order of items
+    Args:
+        func: function doing the read of one item (opencv and the file reads release the GIL)
+        items: iterable of items (filenames)
+        depth: number of items fetched ahead of the one yielded
+        threads: number of threads, default depth
+
+    Returns:
+        iterator of (item, result of func), the time waiting for a result is recorded as the stage prefetch_wait
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=threads or depth) as executor:
+        pending = deque((item, executor.submit(func, item)) for item in islice(items, depth))
+        while pending:
+            item, future = pending.popleft()
+            # keep depth items in flight while this one is consumed
+            for next_item in islice(items, 1):
+                pending.append((next_item, executor.submit(func, next_item)))
+            with stage('prefetch_wait'):
+                result = future.result()
+            yield item, result
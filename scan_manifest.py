@@ -0,0 +1,123 @@
+"""
+Manifest of the duplicate scan persisted between runs of open_image_dup.py:
+the mtime and file list of every scanned directory, the duplicates found per split and the files fingerprints.
+A directory is listed again only when its mtime or the mtime of one of its tar/zip shards changed,
+and only the filenames added or removed are re-checked. The fingerprints need the size and mtime of every file,
+so the files of an unchanged directory are then stat again, which is still much cheaper than hashing them
+"""
+import json
+import os
+import tempfile
+
+from shards import is_shard, get_shard
+
+MANIFEST_VERSION = 1
+
+
+def new_manifest(categories):
+    return {'version': MANIFEST_VERSION, 'categories': list(categories), 'dirs': {}, 'duplicates': {},
+            'fingerprints': {}}
+
+
+def load_manifest(path, categories, full_rescan=False):
+    """
+    Load the manifest of the previous runs
+    Args:
+        path: path to the json manifest
+        categories: categories of the open images datasets of this run
+        full_rescan: if True ignore the stored manifest and scan everything again
+
+    Returns:
+        the manifest, a new one if it does not exist, is outdated or the categories changed
+    """
+    if full_rescan or not os.path.isfile(path):
+        return new_manifest(categories)
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('categories') != list(categories):
+        return new_manifest(categories)
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # write into a temporary file then rename, an interrupted run keeps the previous manifest
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def scan_directory(path, manifest, with_stat=False):
+    """
+    Get the files of a directory from the manifest, listing it again only if its mtime changed
+    Args:
+        path: directory of images
+        manifest: manifest updated with the new listing
+        with_stat: if True the size and mtime of every file are needed
+
+    Returns:
+        dict mapping filename to [size, mtime] (None without stat) and the set of filenames added or removed,
+        the images of the shards have the mtime of their shard and their path through it into the manifest members
+    """
+    previous = manifest['dirs'].get(path)
+    previous_files = previous['files'] if previous else {}
+    if not os.path.isdir(path):
+        manifest['dirs'].pop(path, None)
+        return {}, set(previous_files)
+    mtime = os.stat(path).st_mtime_ns
+    if previous and previous['mtime'] == mtime and (not with_stat or None not in previous['files'].values()) \
+            and shards_unchanged(path, previous.get('shards', {})) \
+            and (not with_stat or restat_files(path, previous_files, previous.get('members', {}))):
+        return previous_files, set()
+    files = {}
+    shard_entries = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # skip the directory labels
+            if not entry.is_file():
+                continue
+            if is_shard(entry.name):
+                shard_entries.append(entry)
+            elif with_stat:
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+            else:
+                files[entry.name] = None
+    shards = {}
+    members = {}
+    for entry in sorted(shard_entries, key=lambda shard_entry: shard_entry.name):
+        shard = get_shard(entry.path)
+        shards[entry.name] = shard.mtime
+        for name, member in shard.images():
+            # a loose image or the image of a previous shard keeps its place
+            if name not in files:
+                files[name] = [shard.members[member], shard.mtime] if with_stat else None
+                members[name] = os.path.join(entry.path, member)
+    manifest['dirs'][path] = {'mtime': mtime, 'files': files, 'shards': shards, 'members': members}
+    return files, set(files).symmetric_difference(previous_files)
+
+
+def restat_files(path, files, members):
+    """ update the [size, mtime] of the loose files of an unchanged directory, a file rewritten in place does not
+    change the directory mtime, return False if a file is missing (the directory is then listed again) """
+    for name in files:
+        if name in members:
+            # images of a shard, checked by the shard mtime
+            continue
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            return False
+        files[name] = [stat.st_size, stat.st_mtime_ns]
+    return True
+
+
+def shards_unchanged(path, shards):
+    # True if every shard listed by the previous scan of the directory has the same mtime
+    for name, mtime in shards.items():
+        shard_path = os.path.join(path, name)
+        if not os.path.isfile(shard_path) or os.stat(shard_path).st_mtime_ns != mtime:
+            return False
+    return True
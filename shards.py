@@ -0,0 +1,224 @@
+"""
+Images and yolo labels stored into tar or zip shards instead of loose files under raw/1/<split>/<category>.
+A shard is an archive placed into the dataset directory, its members are addressed by a path going through the
+archive (<dataset dir>/<shard>.tar/<member>) so that they can be used wherever a loose file path is, and the labels
+of an image member are the members <member dir>/labels/<stem>.txt as for the loose files.
+The member index of every shard is built once per process and the members are read without extracting them:
+tar shards must be uncompressed so that a member is read at its offset, zip members can be compressed
+"""
+import io
+import os
+import tarfile
+import threading
+import zipfile
+
+SHARD_EXTENSIONS = ('.tar', '.zip')
+
+# member index of the shards opened by the process, by path
+_shards = {}
+
+
+def is_shard(name):
+    return name.lower().endswith(SHARD_EXTENSIONS)
+
+
+class Shard:
+    """
+    Member index of one tar or zip archive, member name -> size, built once when the shard is opened
+    Args:
+        path: path to the archive
+    """
+    # the threads hashing the members of a shard open it once
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.is_zip = path.lower().endswith('.zip')
+        if self.is_zip:
+            with zipfile.ZipFile(path) as archive:
+                self.members = {info.filename: info.file_size for info in archive.infolist() if not info.is_dir()}
+            self.offsets = None
+        else:
+            # 'r:' refuses compressed tar, whose members can not be read at an offset
+            with tarfile.open(path, 'r:') as archive:
+                infos = [info for info in archive.getmembers() if info.isfile()]
+            self.members = {info.name: info.size for info in infos}
+            self.offsets = {info.name: info.offset_data for info in infos}
+        self._handle = None
+        self._pid = None
+
+    def _open(self):
+        # the file is opened again in every process, workers of a pool never share the offset of the parent file
+        with self._lock:
+            if self._pid != os.getpid():
+                self._handle = zipfile.ZipFile(self.path) if self.is_zip else os.open(self.path, os.O_RDONLY)
+                self._pid = os.getpid()
+        return self._handle
+
+    def read(self, member):
+        # bytes of the member, KeyError if it is not in the shard
+        size = self.members[member]
+        handle = self._open()
+        if self.is_zip:
+            return handle.read(member)
+        return os.pread(handle, size, self.offsets[member])
+
+    def open(self, member):
+        # seekable binary file of the member, tar members are read at their offset without loading them
+        if self.is_zip:
+            return self._open().open(member)
+        return io.BufferedReader(_TarMember(self._open(), self.offsets[member], self.members[member]))
+
+    def images(self):
+        # (filename, member) of the members that are not labels, in the order of the archive
+        return [(os.path.basename(member), member) for member in self.members
+                if os.path.basename(os.path.dirname(member)) != 'labels']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handle'], state['_pid'] = None, None
+        return state
+
+
+class _TarMember(io.RawIOBase):
+    # read only view of the bytes [offset, offset + size) of an open file descriptor
+
+    def __init__(self, fd, offset, size):
+        super().__init__()
+        self.fd, self.offset, self.size = fd, offset, size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = max(0, position)
+        return self.position
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self.size - self.position))
+        data = os.pread(self.fd, count, self.offset + self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def get_shard(path):
+    # shard of the process, the member index is built again if the archive was modified
+    shard = _shards.get(path)
+    if shard is None or shard.mtime != os.stat(path).st_mtime_ns:
+        shard = _shards[path] = Shard(path)
+    return shard
+
+
+def split_member_path(path):
+    """ split a path going through a shard into (shard path, member name), None for the path of a loose file """
+    lower = path.lower()
+    for extension in SHARD_EXTENSIONS:
+        index = lower.find(extension + os.sep)
+        while index != -1:
+            end = index + len(extension)
+            if path[:end] in _shards or os.path.isfile(path[:end]):
+                return path[:end], path[end + 1:]
+            index = lower.find(extension + os.sep, end)
+    return None
+
+
+def is_member_path(path):
+    return split_member_path(path) is not None
+
+
+def file_exists(path):
+    # os.path.isfile for loose files and shard members
+    member_path = split_member_path(path)
+    if member_path is None:
+        return os.path.isfile(path)
+    shard_path, member = member_path
+    return member in get_shard(shard_path).members
+
+
+def read_bytes(path):
+    # content of a loose file or a shard member
+    member_path = split_member_path(path)
+    if member_path is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    shard_path, member = member_path
+    return get_shard(shard_path).read(member)
+
+
+def read_text(path):
+    return read_bytes(path).decode()
+
+
+def open_file(path):
+    # binary file of a loose file or a shard member
+    member_path = split_member_path(path)
+    if member_path is None:
+        return open(path, 'rb')
+    shard_path, member = member_path
+    return get_shard(shard_path).open(member)
+
+
+def shard_images(shard_path):
+    # (filename, path through the shard) of the images of a shard
+    return [(name, os.path.join(shard_path, member)) for name, member in get_shard(shard_path).images()]
+
+
+def directory_images(directory):
+    """
+    Images stored into the shards of a dataset directory
+    Args:
+        directory: dataset directory
+
+    Returns:
+        dict mapping filename to its path through the shard, the first shard in name order wins, empty without shard
+    """
+    images = {}
+    if not os.path.isdir(directory):
+        return images
+    with os.scandir(directory) as entries:
+        shard_paths = sorted(entry.path for entry in entries if is_shard(entry.name) and entry.is_file())
+    for shard_path in shard_paths:
+        for name, path in shard_images(shard_path):
+            images.setdefault(name, path)
+    return images
+
+
+def shards_stamp(directory):
+    # modification time of every shard of the directory, a shard rewritten in place does not change the directory
+    if not os.path.isdir(directory):
+        return {}
+    with os.scandir(directory) as entries:
+        return {entry.name: entry.stat().st_mtime_ns for entry in entries if is_shard(entry.name) and entry.is_file()}
+
+
+def restat_shards(directory, names):
+    # modification time of the shards of a previous listing of the directory without listing it, None if removed
+    stamp = {}
+    for name in names:
+        try:
+            stamp[name] = os.stat(os.path.join(directory, name)).st_mtime_ns
+        except FileNotFoundError:
+            stamp[name] = None
+    return stamp
+
+
+def label_texts(labels_dir):
+    """ (stem, text) of every label file of a labels directory inside a shard, given by its path through the shard """
+    shard_path, member_dir = split_member_path(labels_dir)
+    shard = get_shard(shard_path)
+    prefix = member_dir.rstrip('/') + '/'
+    return [(member[len(prefix):-4], shard.read(member).decode()) for member in shard.members
+            if member.startswith(prefix) and member.endswith('.txt') and '/' not in member[len(prefix):]]
@@ -0,0 +1,144 @@
+"""
+Per stage timers of the draw scripts: load and index of the annotations, then for every image locate, read,
+annotate, draw and write.
+The durations are collected by every process, gathered into the main process and summarized at the end of a run
+into a json report with the percentiles and histogram of every stage. They are only collected while a run of the
+command line scripts turns the collection on, the datasets used as a library (render_batch) keep nothing.
+A sampled subset of the images can also be rendered under cProfile, one profile per image merged at the end
+"""
+import cProfile
+import json
+import logging
+import os
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGES = ['load', 'index', 'locate', 'read', 'annotate', 'draw', 'write']
+# upper bounds in milliseconds of the histogram buckets, 1-2-5 steps from 10us to 100s
+HISTOGRAM_BOUNDS_MS = [base * 10.0 ** exponent for exponent in range(-2, 5) for base in (1, 2, 5)] + [1e5]
+
+# durations in seconds of the stages run by this process, by stage
+_durations = {}
+# True while a run collects the durations, turned off by run_summary
+_collecting = False
+
+
+def collect_stages(enabled=True):
+    # turn on or off the collection of the stage durations by this process
+    global _collecting
+    _collecting = enabled
+
+
+@contextmanager
+def stage(name):
+    # time the block as one run of the stage name if the durations are collected
+    if not _collecting:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _durations.setdefault(name, []).append(time.perf_counter() - start)
+
+
+def drain():
+    # durations collected by this process since the previous drain, used by the workers to send them back
+    durations = {name: list(values) for name, values in _durations.items()}
+    _durations.clear()
+    return durations
+
+
+def record(durations):
+    # add the durations collected by a worker to the ones of this process
+    for name, values in durations.items():
+        _durations.setdefault(name, []).extend(values)
+
+
+def stage_summary(values):
+    # count, total, percentiles and histogram (counts per bucket of HISTOGRAM_BOUNDS_MS, then above) of one stage
+    values_ms = np.asarray(values, dtype=np.float64) * 1000
+    counts, _ = np.histogram(values_ms, bins=[0.0] + HISTOGRAM_BOUNDS_MS + [np.inf])
+    p50, p90, p99 = np.percentile(values_ms, [50, 90, 99])
+    return {'count': len(values_ms), 'total_seconds': float(values_ms.sum() / 1000),
+            'mean_ms': float(values_ms.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99),
+            'max_ms': float(values_ms.max()), 'histogram': counts.tolist()}
+
+
+def run_summary(images, drawn, wall_seconds):
+    """
+    Summary of the run from the durations collected, the collection is then turned off
+    Args:
+        images: number of images to draw
+        drawn: number of images found, with annotations and drawn
+        wall_seconds: duration of the whole run
+
+    Returns:
+        json serializable dict with the counts of images, the throughput, the upper bounds of the histogram buckets
+        and the summary of every stage run
+    """
+    durations = drain()
+    collect_stages(False)
+    stages = {name: stage_summary(durations[name]) for name in STAGES if durations.get(name)}
+    for name in sorted(set(durations).difference(STAGES)):
+        stages[name] = stage_summary(durations[name])
+    return {'images': images, 'drawn': drawn, 'wall_seconds': wall_seconds,
+            'images_per_second': images / wall_seconds if wall_seconds > 0 else None,
+            'histogram_bounds_ms': HISTOGRAM_BOUNDS_MS, 'stages': stages}
+
+
+def emit_summary(summary, summary_path=None):
+    # log the summary as one json line and write it into summary_path if given
+    logging.info('run summary ' + json.dumps(summary))
+    if summary_path:
+        directory = os.path.dirname(summary_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+def is_sampled(fn, profile_every):
+    # about one image out of profile_every, chosen by its name so the sample is the same whatever the workers
+    return bool(profile_every) and zlib.crc32(fn.encode()) % profile_every == 0
+
+
+@contextmanager
+def profiled(fn, profile_dir, profile_every):
+    """
+    Run the block under cProfile if the image fn is in the sample, its stats are written into profile_dir
+    Args:
+        fn: image filename
+        profile_dir: directory of the profiles, nothing is profiled if None
+        profile_every: about one image out of profile_every is profiled
+    """
+    if not profile_dir or not is_sampled(fn, profile_every):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, os.path.basename(fn) + '.prof'))
+
+
+def merge_profiles(profile_dir):
+    """ merge the profiles of the sampled images into profile_dir/merged.prof, return its path (None if no profile) """
+    import pstats
+
+    if not profile_dir or not os.path.isdir(profile_dir):
+        return None
+    paths = sorted(os.path.join(profile_dir, name) for name in os.listdir(profile_dir)
+                   if name.endswith('.prof') and name != 'merged.prof')
+    if len(paths) == 0:
+        return None
+    stats = pstats.Stats(*paths)
+    merged_path = os.path.join(profile_dir, 'merged.prof')
+    stats.dump_stats(merged_path)
+    return merged_path
@@ -0,0 +1,39 @@
+"""
+Startup budget of the command line scripts: importing a script must stay fast and must not import opencv or pandas,
+which are loaded only by the code paths that need them. Every script is imported in a fresh interpreter
+with python -X importtime
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ['draw_coco', 'draw_openimages', 'open_image_dup', 'merge_annotations', 'annotation_store']
+HEAVY_MODULES = ['pandas', 'cv2']
+# cumulative import time of a script, about 100 ms measured, the margin absorbs slow machines
+BUDGET_US = 400000
+
+
+def import_script(module):
+    # import module with -X importtime, return its cumulative import time in us and the heavy modules loaded
+    code = f"import sys, json, {module}; print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR, capture_output=True,
+                            text=True, check=True)
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].rstrip() == ' ' + module:
+            cumulative = int(fields[1])
+    return cumulative, json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', SCRIPTS)
+def test_import_budget(module):
+    cumulative, heavy = import_script(module)
+    assert cumulative is not None
+    assert cumulative < BUDGET_US, f"importing {module} took {cumulative / 1000:.0f} ms"
+    assert heavy == [], f"importing {module} loaded {heavy}"
@@ -0,0 +1,34 @@
+"""
+Reuse of the image buffer by read_image: a file that can not be decoded must not come back as the previous image
+"""
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from draw_core import read_image  # noqa: E402
+
+
+def write_image(path, value):
+    cv2.imwrite(path, np.full((40, 60, 3), value, dtype=np.uint8))
+    return path
+
+
+def test_corrupt_file_is_skipped(tmp_path):
+    first = write_image(str(tmp_path / 'first.jpg'), 200)
+    corrupt = str(tmp_path / 'corrupt.jpg')
+    with open(corrupt, 'wb') as f:
+        f.write(os.urandom(3000))
+    second = write_image(str(tmp_path / 'second.jpg'), 30)
+
+    image = read_image(first, reuse_buffer=True)
+    assert image is not None
+    # the previous image was drawn on, the buffer must not be returned as the corrupt file
+    image[:] = 0
+    assert read_image(corrupt, reuse_buffer=True) is None
+    assert read_image(str(tmp_path / 'missing.jpg'), reuse_buffer=True) is None
+    image = read_image(second, reuse_buffer=True)
+    assert image is not None
+    assert abs(int(image.mean()) - 30) <= 2
@@ -0,0 +1,28 @@
+"""
+Stage durations are only kept while a run collects them, the datasets used as a library must not accumulate them
+"""
+import pytest
+
+pytest.importorskip('numpy')
+
+from stage_timing import stage, collect_stages, drain, run_summary  # noqa: E402
+
+
+def test_stages_not_kept_without_collection():
+    drain()
+    for _ in range(100):
+        with stage('read'):
+            pass
+    assert drain() == {}
+
+
+def test_run_summary_ends_the_collection():
+    collect_stages()
+    for _ in range(3):
+        with stage('read'):
+            pass
+    summary = run_summary(3, 3, 1.0)
+    assert summary['stages']['read']['count'] == 3
+    with stage('read'):
+        pass
+    assert drain() == {}
@@ -0,0 +1,24 @@
+"""
+The yolo label files are parsed the same way per file and with --bulk_labels: blank lines, lines without 5 values
+and repeated spaces are skipped, the extra columns are ignored
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('numpy')
+
+from draw_openimages import get_yolo_boxes  # noqa: E402
+from yolo_labels import YoloLabels  # noqa: E402
+
+LABEL_TEXT = "0 10 10 100 100\n\n1  20 20 200 200\n2 30 30\n1 5 5 50 50 0.9\n"
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_label_file_parsed_in_both_modes(tmp_path, bulk):
+    (tmp_path / 'labels').mkdir()
+    (tmp_path / 'labels' / 'image.txt').write_text(LABEL_TEXT)
+    yolo_labels = YoloLabels() if bulk else None
+    boxes, labels = get_yolo_boxes('image.jpg', [str(tmp_path / 'image.jpg')], yolo_labels=yolo_labels)
+    np.testing.assert_array_equal(np.asarray(boxes, dtype=np.float64),
+                                  [[10, 10, 100, 100], [20, 20, 200, 200], [5, 5, 50, 50]])
+    assert list(labels) == ['0', '1', '1']
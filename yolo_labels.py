@@ -0,0 +1,103 @@
+"""
+Bulk loader of the yolo labels: a whole labels directory is read once into packed arrays
+(class and 4 coordinates of every box, grouped by image with an offsets table) instead of opening and parsing
+one label file per image and per dataset copy
+"""
+import logging
+import os
+
+import numpy as np
+
+from shards import is_member_path, label_texts
+
+
+def _label_tokens(text):
+    # tokens of the lines "class x1 y1 x2 y2" of a label file, the extra columns (confidence ...) are ignored
+    # and lines without 5 values are skipped
+    tokens = []
+    for line in text.splitlines():
+        values = line.split()
+        if len(values) >= 5:
+            tokens.extend(values[:5])
+    return tokens
+
+
+def load_labels_dir(labels_dir):
+    """
+    Read every label file of a yolo labels directory
+    Args:
+        labels_dir: directory containing one <stem>.txt file per image
+
+    Returns:
+        dict mapping image stem to a tuple (coordinates float64 array (N, 4), class int32 array (N,))
+    """
+    if not os.path.isdir(labels_dir):
+        logging.info(f"directory {labels_dir} does not exist")
+        return {}
+    label_files = []
+    with os.scandir(labels_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt') or not entry.is_file():
+                continue
+            with open(entry.path, 'r') as f:
+                label_files.append((entry.name[:-4], f.read()))
+    return pack_labels(label_files)
+
+
+def pack_labels(label_files):
+    """
+    Parse the label files of a directory at once
+    Args:
+        label_files: list of (image stem, content of its label file)
+
+    Returns:
+        dict mapping image stem to a tuple (coordinates float64 array (N, 4), class int32 array (N,))
+    """
+    stems = []
+    counts = []
+    tokens = []
+    for stem, text in label_files:
+        file_tokens = _label_tokens(text)
+        stems.append(stem)
+        counts.append(len(file_tokens) // 5)
+        tokens.extend(file_tokens)
+    # one vectorized conversion of all the values of the directory
+    values = np.array(tokens, dtype=np.float64).reshape(-1, 5)
+    classes = values[:, 0].astype(np.int32)
+    coords = values[:, 1:]
+    offsets = np.zeros(len(stems) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return {stem: (coords[offsets[i]:offsets[i + 1]], classes[offsets[i]:offsets[i + 1]])
+            for i, stem in enumerate(stems)}
+
+
+class YoloLabels:
+    """
+    Labels of the yolo datasets, every labels directory is loaded once on first use
+    Args:
+        cache_dir: if given the packed labels are stored there and reused while the directory mtime is unchanged
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.indexes = {}
+
+    def labels_index(self, labels_dir):
+        if labels_dir not in self.indexes:
+            if is_member_path(labels_dir):
+                # labels stored into a shard are read from its member index, the shard is not cached again
+                self.indexes[labels_dir] = pack_labels(label_texts(labels_dir))
+            elif self.cache_dir and os.path.isdir(labels_dir):
+                from annotation_cache import cached_index
+
+                self.indexes[labels_dir], _ = cached_index(self.cache_dir, labels_dir, 'yolo',
+                                                           lambda: (load_labels_dir(labels_dir), None))
+            else:
+                self.indexes[labels_dir] = load_labels_dir(labels_dir)
+        return self.indexes[labels_dir]
+
+    def get(self, image_path):
+        """ boxes and classes of the image from the labels directory next to it, None if it has no label file """
+        labels_dir = os.path.join(os.path.dirname(image_path), 'labels')
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return self.labels_index(labels_dir).get(stem)